@@ -1,6 +1,16 @@
 """
 All WSGI middleware should be applied here
 """
+# stdlib imports
+import os
+import sys
+
+# Make nacelle's bundled libraries (e.g. raven) importable by requests
+# which don't pass through nacelle.app, such as deferred tasks run by
+# the deferred builtin
+NACELLE_LIB = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'nacelle', 'lib')
+if NACELLE_LIB not in sys.path:
+    sys.path.insert(0, NACELLE_LIB)
 
 
 def webapp_add_wsgi_middleware(app):
@@ -1,9 +1,13 @@
 """
 A simple collection of handlers that are used in a new project
 """
+# third-party imports
+import webapp2
+
 # local imports
 from nacelle.handlers.base import JSONHandler
 from nacelle.handlers.base import TemplateHandler
+from nacelle.handlers.mixins import TemplateMixins
 
 
 class NewProjectHandler(TemplateHandler):
@@ -33,3 +37,17 @@ class JSONRaiseHandler(JSONHandler):
 
     def get_context(self):
         self.abort(500)
+
+
+class WarmupHandler(TemplateMixins, webapp2.RequestHandler):
+
+    """
+    Handles appengine warmup requests by building our template
+    directory index and shared jinja instance before any user
+    requests hit this instance
+    """
+
+    def get(self):
+        # accessing the jinja instance builds and caches it
+        self.jinja2
+        self.response.write('OK')
@@ -3,4 +3,8 @@ from webapp2 import Route
 ROUTES = [
     # Default route to display a welcome page on a new project build
     (r'/', 'default_app.handlers.NewProjectHandler'),
+    # Warmup route to prime per-instance caches on a new instance
+    (r'/_ah/warmup', 'default_app.handlers.WarmupHandler'),
+    # Cron route to remove expired server side sessions
+    (r'/_cron/sessions/sweep', 'nacelle.handlers.sessions.SessionSweepHandler'),
 ]
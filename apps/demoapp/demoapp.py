@@ -63,6 +63,8 @@ class DemoQueryHandler(FixedQueryAPIHandler):
     model = DemoModel
     # default page size for results returned from this handler
     page_size = 100
+    # write large pages entity by entity to limit memory use
+    stream = True
     # allowed HTTP methods for this handler
     allowed_methods = ['GET', 'POST']
 
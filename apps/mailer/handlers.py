@@ -3,16 +3,33 @@ Handlers for the nacelle mailer app
 """
 # stdlib import
 import datetime
+import json
+import logging
 
 # third-party imports
 import webapp2
+from google.appengine.api import mail
 from google.appengine.api import taskqueue
+from google.appengine.ext import db
+from iso8601 import ParseError
 from iso8601 import parse_date
 
 # local imports
 from mailer.models import Email
 from mailer.models import ScheduledEmail
+from nacelle.decorators.auth import admin_required
 from nacelle.handlers.mixins import JSONMixins
+from nacelle.models.validators import ValidationError
+
+# number of emails sent by each delivery task
+SEND_BATCH_SIZE = 50
+# number of times a dispatch task will be retried (delivery tasks are
+# never retried so that emails can't be sent twice)
+DISPATCH_RETRY_LIMIT = 5
+# format used to pass the dispatch time between tasks
+DISPATCH_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+# maximum number of emails accepted by a single bulk send request
+BULK_MAX_EMAILS = 1000
 
 
 class EmailAPIHandler(JSONMixins, webapp2.RequestHandler):
@@ -89,28 +106,242 @@ class ScheduledEmailAPIHandler(JSONMixins, webapp2.RequestHandler):
         return self.json_response(response)
 
 
+def queue_delivery_task(keys):
+
+    """
+    Queue a task to send a batch of scheduled emails
+    """
+
+    taskqueue.add(
+        url='/_cron/mailer/send_batch',
+        queue_name='mail-queue',
+        params={'keys': ','.join(str(key) for key in keys)},
+    )
+
+
+class BulkEmailAPIHandler(JSONMixins, webapp2.RequestHandler):
+
+    """
+    AJAX Handler to allow sending of many emails in a single request.
+
+    Accepts either a JSON array of email objects or newline delimited
+    JSON (one email object per line).  All emails are validated before
+    any are saved, valid emails are saved in batches and delivered
+    asynchronously by the mail queue.
+    """
+
+    def parse_emails(self):
+
+        """
+        Parse the request body into a list of email objects (or
+        exceptions for any lines which couldn't be parsed)
+        """
+
+        body = self.request.body
+        try:
+            items = json.loads(body)
+        except ValueError:
+            items = None
+        if isinstance(items, list):
+            return items
+
+        # fall back to parsing as newline delimited JSON
+        items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError, e:
+                items.append(e)
+        return items
+
+    def build_email(self, item, now):
+
+        """
+        Build and validate a ScheduledEmail from an email object
+        """
+
+        if isinstance(item, Exception):
+            raise item
+        if not isinstance(item, dict):
+            raise ValidationError('email must be a JSON object')
+
+        # send immediately unless a time has been specified
+        time_scheduled = item.get('time_scheduled')
+        if time_scheduled is None:
+            time_scheduled = now
+        else:
+            time_scheduled = parse_date(time_scheduled)
+            # store as naive UTC like the rest of the datastore
+            time_scheduled = (time_scheduled - time_scheduled.utcoffset()).replace(tzinfo=None)
+
+        def address_list(value):
+            if value is None:
+                return []
+            if isinstance(value, basestring):
+                return [value]
+            return list(value)
+
+        email = ScheduledEmail(
+            time_scheduled=time_scheduled,
+            sender=item.get('sender'),
+            to=address_list(item.get('to')),
+            cc=address_list(item.get('cc')),
+            bcc=address_list(item.get('bcc')),
+            reply_to=item.get('reply_to'),
+            subject=item.get('subject'),
+            body_plain=item.get('body_plain'),
+            body_html=item.get('body_html'),
+        )
+        email.validate_mail()
+        return email
+
+    def post(self):
+
+        items = self.parse_emails()
+        if not items:
+            self.response.set_status(400)
+            return self.json_response({'error': 'No emails specified'})
+        if len(items) > BULK_MAX_EMAILS:
+            self.response.set_status(400)
+            return self.json_response({'error': 'No more than %d emails may be sent at once' % BULK_MAX_EMAILS})
+
+        # validate every email up front
+        now = datetime.datetime.utcnow()
+        results = []
+        emails = []
+        for index, item in enumerate(items):
+            try:
+                email = self.build_email(item, now)
+            except (ValidationError, ParseError, mail.Error, db.Error, TypeError, ValueError), e:
+                results.append({'index': index, 'error': str(e)})
+            else:
+                results.append({'index': index})
+                emails.append((index, email))
+
+        # save valid emails in batches and queue any that are
+        # due for delivery (the rest will be sent by the cron)
+        queued = 0
+        saved = 0
+        for start in range(0, len(emails), SEND_BATCH_SIZE):
+            chunk = emails[start:start + SEND_BATCH_SIZE]
+            try:
+                keys = db.put([email for index, email in chunk])
+            except db.Error, e:
+                # earlier chunks have already been saved (and queued) so
+                # report the failure per email rather than failing the
+                # whole request, letting the client resubmit just these
+                logging.exception(e)
+                for index, email in chunk:
+                    results[index]['error'] = 'Unable to save email: %s' % e
+                continue
+            saved += len(keys)
+            due = []
+            for (index, email), key in zip(chunk, keys):
+                results[index]['key'] = str(key)
+                if email.time_scheduled <= now:
+                    due.append(key)
+            if due:
+                try:
+                    queue_delivery_task(due)
+                except taskqueue.Error, e:
+                    # these are saved so the cron will still send them
+                    logging.exception(e)
+                else:
+                    queued += len(due)
+
+        response = {'results': results, 'saved': saved, 'queued': queued}
+        return self.json_response(response)
+
+
+def queue_dispatch_task(now, cursor=None):
+
+    """
+    Queue a task to dispatch the next page of due scheduled emails
+    """
+
+    params = {'now': now.strftime(DISPATCH_TIME_FORMAT)}
+    if cursor is not None:
+        params['cursor'] = cursor
+    taskqueue.add(
+        url='/_cron/mailer/send_scheduled',
+        queue_name='mail-queue',
+        params=params,
+        retry_options=taskqueue.TaskRetryOptions(task_retry_limit=DISPATCH_RETRY_LIMIT),
+    )
+
+
 class CronScheduledEmailHandler(JSONMixins, webapp2.RequestHandler):
 
     """
-    Cron handler to send any scheduled emails
+    Cron handler to send any scheduled emails.
+
+    Due emails are paged through with a query cursor and each page is
+    handed off to a delivery task.  The cursor for the next page is passed
+    on to the next dispatch task so that a dispatch task which dies is
+    retried from the last cursor rather than starting over.
     """
 
     def get(self):
 
         # run handler on a task queue
-        taskqueue.add(url='/_cron/mailer/send_scheduled', queue_name='mail-queue')
+        queue_dispatch_task(datetime.datetime.utcnow())
         return self.json_response({'status': "Task queued"})
 
     def post(self):
 
-        now = datetime.datetime.utcnow()
-        query = ScheduledEmail.all().filter('time_scheduled <', now)
+        # every page must be read with an identical query for
+        # the cursor to be valid so use the original dispatch time
+        now = self.request.get('now', default_value=None)
+        if now is None:
+            now = datetime.datetime.utcnow()
+        else:
+            now = datetime.datetime.strptime(now, DISPATCH_TIME_FORMAT)
+        cursor = self.request.get('cursor', default_value=None)
+
+        query = ScheduledEmail.all(keys_only=True).filter('time_scheduled <', now)
         query = query.filter('failed =', False)
         query = query.filter('sent =', False)
         query = query.order('time_scheduled')
+        if cursor:
+            query = query.with_cursor(cursor)
+
+        keys = query.fetch(SEND_BATCH_SIZE)
+        if keys:
+            # hand this page of emails off to a delivery task
+            queue_delivery_task(keys)
+        if len(keys) == SEND_BATCH_SIZE:
+            # carry on from where we left off in a new task
+            queue_dispatch_task(now, query.cursor())
+
+        response = {'status': 'Task complete', 'queued': len(keys)}
+        return self.json_response(response)
+
+
+class ScheduledEmailBatchHandler(JSONMixins, webapp2.RequestHandler):
+
+    """
+    Task handler which sends a batch of scheduled emails
+    """
+
+    @admin_required
+    def post(self):
+
+        now = datetime.datetime.utcnow()
+        keys = [db.Key(key) for key in self.request.get('keys').split(',') if key]
+        # skip any emails which have been dealt with since being queued
+        # or which aren't due to be sent yet
+        emails = [
+            e for e in db.get(keys)
+            if e is not None and not e.sent and not e.failed and e.time_scheduled <= now
+        ]
+
+        for email in emails:
+            email.deliver()
 
-        for email in query.run():
-            email.send()
+        # save all of the sent/failed emails in one batch
+        db.put(emails)
 
-        response = {'status': 'Task complete'}
+        response = {'status': 'Task complete', 'sent': len([e for e in emails if e.sent])}
         return self.json_response(response)
@@ -12,6 +12,7 @@ from google.appengine.ext import db
 from nacelle.models.base import JSONModel
 from nacelle.models.validators import ValidationError
 from nacelle.models.validators import validate_email
+from nacelle.models.validators import validate_emails
 
 
 class Email(JSONModel):
@@ -121,17 +122,14 @@ class Email(JSONModel):
             # raise ValidationError if no recipients specified
             raise ValidationError('At least one to: address must be specified')
 
-        # check to: addresses are valid
-        for to_address in self.to:
-            validate_email(to_address)
-
-        # check cc: addresses are valid
-        for cc_address in self.cc:
-            validate_email(cc_address)
-
-        # check bcc: addresses are valid
-        for bcc_address in self.bcc:
-            validate_email(bcc_address)
+        # check to:, cc: and bcc: addresses are valid in one batch
+        addresses = self.to + self.cc + self.bcc
+        errors = validate_emails(addresses)
+        if errors:
+            # raise the error for the first invalid address
+            for address in addresses:
+                if address in errors:
+                    raise errors[address]
 
         # validate reply_to address, this isn't required as can
         # be generated at sending time if is blank
@@ -179,7 +177,12 @@ class ScheduledEmail(Email):
     # we don't constantly retry it
     failed = db.BooleanProperty(default=False)
 
-    def send(self):
+    def deliver(self):
+
+        """
+        Send the email and mark it as sent (or failed) without saving
+        it, allowing many emails to be saved in a single batch
+        """
 
         try:
             # call Email's send method
@@ -191,6 +194,11 @@ class ScheduledEmail(Email):
             # mark the email as sent
             self.sent = True
 
+    def send(self):
+
+        # send the email
+        self.deliver()
+
         # save the model instance
         self.put()
 
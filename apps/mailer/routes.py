@@ -10,6 +10,8 @@ ROUTES = [
     # time handler route
     Route(r'/mailer/send', 'mailer.handlers.EmailAPIHandler'),
     Route(r'/mailer/send_scheduled', 'mailer.handlers.ScheduledEmailAPIHandler'),
+    Route(r'/mailer/send_bulk', 'mailer.handlers.BulkEmailAPIHandler'),
 
-    Route(r'/_cron/mailer/send_scheduled', 'mailer.handlers.CronScheduledEmailHandler')
+    Route(r'/_cron/mailer/send_scheduled', 'mailer.handlers.CronScheduledEmailHandler'),
+    Route(r'/_cron/mailer/send_batch', 'mailer.handlers.ScheduledEmailBatchHandler'),
 ]
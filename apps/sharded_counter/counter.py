@@ -1,17 +1,236 @@
 """
 A simple sharded counter implementation for use when a
 very high performance counter is needed
+
+Counters can also be updated in buffered mode (see buffered_increment
+and buffered_decrement).  Buffered updates are accumulated in memcache
+in a bucket per FLUSH_INTERVAL second window.  Once a window has closed
+a task (named after the counter and window, so only one is queued)
+folds that window's bucket into the counter's shards in a single
+transaction.  Each hit costs a couple of memcache RPCs and no datastore
+RPCs.  A closed bucket is never written to again and is claimed with
+memcache.add before being flushed, so overlapping or retried flush
+tasks can't count the same updates twice.
+
+Accuracy of buffered counters: get_count includes the buckets of the
+last PENDING_WINDOWS windows so reads are accurate while memcache holds
+them, unless flush tasks are delayed for longer than that.  A read made
+while a bucket is being flushed may count it twice.  A flush drops the
+cached total once the bucket has been deleted, but a read which fetched
+the shards just before the flush and cached their total just after it
+will miss the bucket's updates for up to COUNT_CACHE_TIME seconds.
+Pending updates live only in memcache until flushed, so if memcache
+evicts a bucket its updates (at most FLUSH_INTERVAL seconds worth) are
+lost.  Updates from instances whose clocks run more than FLUSH_GRACE
+seconds behind may land in a bucket which has already been flushed and
+be lost.
 """
 # stdlib imports
+import hashlib
+import logging
 import random
+import time
 
 # third-party imports
 from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from google.appengine.ext import db
 
 # local imports
 from models import GeneralCounterShard
 from models import GeneralCounterShardConfig
+from nacelle.utils import uniqify
+from nacelle.utils.lrucache import LRUCache
+
+# number of seconds buffered updates are held in memcache before
+# being written to the datastore
+FLUSH_INTERVAL = 10
+# number of seconds after a window closes before its bucket is flushed
+FLUSH_GRACE = 2
+# number of closed windows whose buckets are included in counts
+PENDING_WINDOWS = 6
+# number of seconds a flushed bucket's claim is remembered for
+FLUSH_CLAIM_TIME = 3600
+# url of the task handler which flushes buffered updates
+FLUSH_URL = '/_counter/flush'
+# number of seconds for which counter totals are cached in memcache
+COUNT_CACHE_TIME = 60
+# maximum number of keys to fetch from the datastore in a single batch
+MAX_BATCH_GET = 1000
+# number of seconds for which counter configs are cached in instance
+# memory and in memcache.  Configs are removed from memcache when the
+# number of shards changes but other instances may keep using the old
+# value for up to CONFIG_LOCAL_CACHE_TIME seconds.
+CONFIG_LOCAL_CACHE_TIME = 60
+CONFIG_MEMCACHE_TIME = 3600
+# prefix for memcache keys holding counter configs
+CONFIG_KEY_PREFIX = 'counter-config:'
+
+# per-instance cache of the number of shards configured for each counter
+_config_cache = LRUCache(max_size=1000, ttl=CONFIG_LOCAL_CACHE_TIME)
+
+
+def _current_window():
+    return int(time.time() / FLUSH_INTERVAL)
+
+
+def _pending_keys(name, window):
+
+    """
+    Build the memcache keys which hold a window's buffered increments
+    and decrements for a counter (memcache can't store negative values
+    so these are tracked separately)
+    """
+
+    return 'counter-incr:%s:%d' % (name, window), 'counter-decr:%s:%d' % (name, window)
+
+
+def _recent_pending_keys(name):
+
+    """
+    Build the pending keys of every window which may not have been
+    flushed yet
+    """
+
+    current = _current_window()
+    keys = []
+    for window in range(current - PENDING_WINDOWS, current + 1):
+        keys.append(_pending_keys(name, window))
+    return keys
+
+
+def _shard_keys(name, num_shards):
+
+    """
+    Build the keys of all shards for a given counter.  Shard key names
+    are deterministic so no query is needed to find them.
+    """
+
+    kind = GeneralCounterShard.kind()
+    return [db.Key.from_path(kind, name + str(index)) for index in range(num_shards)]
+
+
+def get_num_shards(names, use_local_cache=True):
+
+    """
+    Return a dict mapping counter names to their configured number of
+    shards, checking instance memory, then memcache, then the datastore.
+    Counters which have no config yet are omitted.
+
+    Parameters:
+      names - A list of counter names
+      use_local_cache - Set False to skip the per-instance cache
+    """
+
+    num_shards = {}
+    uncached = []
+    for name in names:
+        value = _config_cache.get(name) if use_local_cache else None
+        if value is None:
+            uncached.append(name)
+        else:
+            num_shards[name] = value
+    if not uncached:
+        return num_shards
+
+    cached = memcache.get_multi(uncached, key_prefix=CONFIG_KEY_PREFIX)
+    # get any configs missing from memcache in one batch
+    missing = [name for name in uncached if name not in cached]
+    if missing:
+        kind = GeneralCounterShardConfig.kind()
+        configs = db.get([db.Key.from_path(kind, name) for name in missing])
+        found = {}
+        for name, config in zip(missing, configs):
+            if config is not None:
+                found[name] = config.num_shards
+        if found:
+            memcache.set_multi(found, CONFIG_MEMCACHE_TIME, key_prefix=CONFIG_KEY_PREFIX)
+        cached.update(found)
+
+    for name, value in cached.items():
+        _config_cache.set(name, value)
+        num_shards[name] = value
+    return num_shards
+
+
+def _get_or_create_num_shards(name):
+
+    """
+    Return the number of shards for a counter, creating its config if
+    it doesn't exist yet
+    """
+
+    num_shards = get_num_shards([name]).get(name)
+    if num_shards is None:
+        config = GeneralCounterShardConfig.get_or_insert(name, name=name)
+        num_shards = config.num_shards
+        _config_cache.set(name, num_shards)
+        memcache.set(CONFIG_KEY_PREFIX + name, num_shards, CONFIG_MEMCACHE_TIME)
+    return num_shards
+
+
+def _get_durable_counts(names):
+
+    """
+    Sum the shards of each of the given counters using batched gets
+    rather than an index query per counter
+    """
+
+    # skip the instance cache so we see any recently added shards
+    num_shards = get_num_shards(names, use_local_cache=False)
+
+    # build the keys of every shard for every counter, shard key names
+    # can collide between counters (e.g. 'a' + '10' and 'a1' + '0') so
+    # make sure we only fetch each shard once
+    shard_keys = []
+    for name in names:
+        if name in num_shards:
+            shard_keys.extend(_shard_keys(name, num_shards[name]))
+    shard_keys = uniqify(shard_keys)
+
+    totals = dict((name, 0) for name in names)
+    for index in range(0, len(shard_keys), MAX_BATCH_GET):
+        for shard in db.get(shard_keys[index:index + MAX_BATCH_GET]):
+            # check the shard's name as shard key names can collide
+            if shard is not None and shard.name in totals:
+                totals[shard.name] += shard.count
+    return totals
+
+
+def get_counts(names):
+
+    """
+    Retrieve the values for many sharded counters at once using a single
+    memcache lookup and batched datastore gets for any uncached totals.
+    Returns a dict mapping counter names to values.
+
+    Parameters:
+      names - A list of counter names
+    """
+
+    names = uniqify(names)
+    cache_keys = list(names)
+    pending_keys = {}
+    for name in names:
+        pending_keys[name] = _recent_pending_keys(name)
+        for keys in pending_keys[name]:
+            cache_keys.extend(keys)
+    cached = memcache.get_multi(cache_keys)
+
+    # get any uncached totals from the datastore
+    uncached = [name for name in names if name not in cached]
+    if uncached:
+        totals = _get_durable_counts(uncached)
+        memcache.add_multi(totals, COUNT_CACHE_TIME)
+        cached.update(totals)
+
+    counts = {}
+    for name in names:
+        counts[name] = cached[name]
+        # include any buffered updates which haven't been flushed yet
+        for incr_key, decr_key in pending_keys[name]:
+            counts[name] += cached.get(incr_key, 0) - cached.get(decr_key, 0)
+    return counts
 
 
 def get_count(name):
@@ -23,36 +242,55 @@ def get_count(name):
       name - The name of the counter
     """
 
-    total = memcache.get(name)
-    if total is None:
-        total = 0
-        for counter in GeneralCounterShard.all().filter('name = ', name):
-            total += counter.count
-        memcache.add(name, total, 60)
-    return total
+    return get_counts([name])[name]
 
 
-def decrement(name):
+def refresh_counts(names):
 
     """
-    Increment the value for a given sharded counter.
+    Recalculate the cached totals of many (hot) counters from their
+    shards in a single batch and return their current values.
 
     Parameters:
-      name - The name of the counter
+      names - A list of counter names
     """
 
-    config = GeneralCounterShardConfig.get_or_insert(name, name=name)
+    names = uniqify(names)
+    memcache.set_multi(_get_durable_counts(names), COUNT_CACHE_TIME)
+    return get_counts(names)
+
+
+def _apply_delta(name, delta):
+
+    """
+    Add delta to a randomly chosen shard of the given counter in a
+    single transaction
+    """
+
+    num_shards = _get_or_create_num_shards(name)
 
     def txn():
-        index = random.randint(0, config.num_shards - 1)
+        index = random.randint(0, num_shards - 1)
         shard_name = name + str(index)
         counter = GeneralCounterShard.get_by_key_name(shard_name)
         if counter is None:
             counter = GeneralCounterShard(key_name=shard_name, name=name)
-        counter.count -= 1
+        counter.count += delta
         counter.put()
     db.run_in_transaction(txn)
 
+
+def decrement(name):
+
+    """
+    Increment the value for a given sharded counter.
+
+    Parameters:
+      name - The name of the counter
+    """
+
+    _apply_delta(name, -1)
+
     # does nothing if the key does not exist
     memcache.decr(name)
 
@@ -66,22 +304,131 @@ def increment(name):
       name - The name of the counter
     """
 
-    config = GeneralCounterShardConfig.get_or_insert(name, name=name)
-
-    def txn():
-        index = random.randint(0, config.num_shards - 1)
-        shard_name = name + str(index)
-        counter = GeneralCounterShard.get_by_key_name(shard_name)
-        if counter is None:
-            counter = GeneralCounterShard(key_name=shard_name, name=name)
-        counter.count += 1
-        counter.put()
-    db.run_in_transaction(txn)
+    _apply_delta(name, 1)
 
     # does nothing if the key does not exist
     memcache.incr(name)
 
 
+def _schedule_flush(name, window):
+
+    """
+    Queue a task to flush the given counter's buffered updates for a
+    window once it has closed, unless one has already been queued
+    """
+
+    lock_key = 'counter-flush:%s:%d' % (name, window)
+    # memcache.add only succeeds for the first caller in each window,
+    # the task name stops duplicates if the lock is evicted
+    if memcache.add(lock_key, True, FLUSH_INTERVAL * 2):
+        countdown = (window + 1) * FLUSH_INTERVAL - time.time() + FLUSH_GRACE
+        name_hash = hashlib.md5(name.encode('utf-8') if isinstance(name, unicode) else name).hexdigest()
+        task_name = 'counter-flush-%s-%d' % (name_hash, window)
+        try:
+            taskqueue.add(
+                url=FLUSH_URL,
+                name=task_name,
+                params={'name': name, 'window': window},
+                countdown=max(0, countdown),
+            )
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
+        except taskqueue.Error, e:
+            # let the next update try again
+            logging.exception(e)
+            memcache.delete(lock_key)
+
+
+def buffered_increment(name, delta=1):
+
+    """
+    Increment the value for a given sharded counter by buffering the
+    update in memcache to be written to the datastore later.
+
+    Parameters:
+      name - The name of the counter
+      delta - The amount to increment the counter by
+    """
+
+    window = _current_window()
+    memcache.incr(_pending_keys(name, window)[0], delta, initial_value=0)
+    _schedule_flush(name, window)
+
+
+def buffered_decrement(name, delta=1):
+
+    """
+    Decrement the value for a given sharded counter by buffering the
+    update in memcache to be written to the datastore later.
+
+    Parameters:
+      name - The name of the counter
+      delta - The amount to decrement the counter by
+    """
+
+    window = _current_window()
+    memcache.incr(_pending_keys(name, window)[1], delta, initial_value=0)
+    _schedule_flush(name, window)
+
+
+def flush(name, window):
+
+    """
+    Fold a closed window's buffered updates for a given counter into its
+    shards.  Returns the net change written to the datastore.
+
+    Parameters:
+      name - The name of the counter
+      window - The window to flush
+    """
+
+    # the window's bucket may still be written to until it has closed
+    if window >= _current_window():
+        raise ValueError('Window %d has not closed yet' % window)
+
+    # claim the bucket, only one flush may ever apply it
+    claim_key = 'counter-flushed:%s:%d' % (name, window)
+    if not memcache.add(claim_key, True, FLUSH_CLAIM_TIME):
+        return 0
+
+    incr_key, decr_key = _pending_keys(name, window)
+    pending = memcache.get_multi([incr_key, decr_key])
+    delta = pending.get(incr_key, 0) - pending.get(decr_key, 0)
+    if delta:
+        try:
+            _apply_delta(name, delta)
+        except Exception:
+            # release the claim so that a retry can flush the bucket
+            memcache.delete(claim_key)
+            raise
+    if pending:
+        memcache.delete_multi([incr_key, decr_key])
+
+    # drop the cached total so that the next read rebuilds it from the
+    # shards.  Adjusting it in place could apply the delta twice if a
+    # read cached a total which already included it.
+    if delta:
+        memcache.delete(name)
+    return delta
+
+
+def flush_pending(name):
+
+    """
+    Flush every closed window which may still hold buffered updates
+    for a given counter.  Returns the net change written.
+
+    Parameters:
+      name - The name of the counter
+    """
+
+    current = _current_window()
+    delta = 0
+    for window in range(current - PENDING_WINDOWS, current):
+        delta += flush(name, window)
+    return delta
+
+
 def increase_shards(name, num):
 
     """
@@ -101,3 +448,7 @@ def increase_shards(name, num):
             config.num_shards = num
             config.put()
     db.run_in_transaction(txn)
+
+    # invalidate cached configs
+    _config_cache.delete(name)
+    memcache.delete(CONFIG_KEY_PREFIX + name)
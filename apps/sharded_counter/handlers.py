@@ -1,4 +1,10 @@
+# third-party imports
+import webapp2
+
+# local imports
+from nacelle.decorators.auth import admin_required
 from nacelle.handlers.base import JSONHandler
+from nacelle.handlers.mixins import JSONMixins
 import counter
 
 
@@ -14,9 +20,30 @@ class CounterHandler(JSONHandler):
         Increment and return the specified counter's value
         """
 
-        # increment the specified counter
-        counter.increment(counter_name)
+        # increment the specified counter (buffered in memcache and
+        # written to the datastore in batches)
+        counter.buffered_increment(counter_name)
         # get the counter value
         hit_count = counter.get_count(counter_name)
         # return the counter value as JSON object
         return {'count': hit_count}
+
+
+class CounterFlushHandler(JSONMixins, webapp2.RequestHandler):
+
+    """
+    Task handler which writes a counter's buffered updates to the datastore
+    """
+
+    @admin_required
+    def post(self):
+
+        # fold buffered updates into the counter's shards
+        counter_name = self.request.get('name')
+        window = self.request.get('window')
+        if window:
+            delta = counter.flush(counter_name, int(window))
+        else:
+            # tasks queued without a window flush everything pending
+            delta = counter.flush_pending(counter_name)
+        return self.json_response({'name': counter_name, 'flushed': delta})
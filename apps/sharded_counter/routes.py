@@ -3,4 +3,6 @@ from webapp2 import Route
 ROUTES = [
     # sharded counter handler route
     Route(r'/counter/<counter_name>', 'sharded_counter.handlers.CounterHandler'),
+    # task handler which flushes buffered counter updates
+    Route(r'/_counter/flush', 'sharded_counter.handlers.CounterFlushHandler'),
 ]
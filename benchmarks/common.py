@@ -0,0 +1,71 @@
+"""
+Helpers shared by nacelle's benchmark scripts.
+
+The benchmarks are standalone scripts, run from the project root with the
+appengine SDK either importable already or pointed to by APPENGINE_SDK:
+
+    $ APPENGINE_SDK=/path/to/google_appengine python benchmarks/serialize.py
+"""
+# stdlib imports
+import os
+import sys
+import timeit
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+def setup_path():
+
+    """
+    Add the appengine SDK (if APPENGINE_SDK is set) and the project's lib
+    and apps directories to the python path
+    """
+
+    sdk_path = os.environ.get('APPENGINE_SDK')
+    if sdk_path:
+        sys.path.insert(0, sdk_path)
+        import dev_appserver
+        dev_appserver.fix_sys_path()
+    sys.path.insert(0, PROJECT_ROOT)
+    # mirror the setup performed in nacelle/app.py
+    from nacelle.compile_templates import setup_path as setup_project_path
+    setup_project_path(PROJECT_ROOT)
+
+
+def activate_testbed():
+
+    """
+    Activate a testbed with in-memory datastore, memcache and task queue
+    stubs so that the benchmarks never touch a real service
+    """
+
+    from google.appengine.ext import testbed
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_datastore_v3_stub()
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub()
+    return bed
+
+
+def bench(fn, number, repeat=3):
+
+    """
+    Return the best time in seconds taken by number calls of fn over
+    repeat runs
+    """
+
+    return min(timeit.repeat(fn, number=number, repeat=repeat))
+
+
+def report(label, seconds, number, baseline=None):
+
+    """
+    Print the total and per call time of a benchmark, along with its
+    speedup over a baseline time if given
+    """
+
+    line = '%-36s %8.3fs %10.2fus/call' % (label, seconds, seconds / number * 1e6)
+    if baseline is not None:
+        line += '  %6.1fx' % (baseline / seconds)
+    print line
@@ -0,0 +1,148 @@
+"""
+Benchmark of the cost per cache hit of the memorise decorator, comparing
+the old wrapper (which analysed the function and called inspect.getmodule
+on every call) with the current one on memcache hits and local (L1)
+cache hits.
+
+Run from the project root (see benchmarks/common.py):
+
+    $ python benchmarks/memorise.py [calls]
+"""
+# stdlib imports
+import inspect
+import itertools
+import sys
+from functools import wraps
+from hashlib import md5
+
+# local imports
+from common import activate_testbed
+from common import bench
+from common import report
+from common import setup_path
+
+# number of calls per run
+DEFAULT_CALLS = 20000
+
+
+class old_memorise(object):
+
+    """
+    The memorise decorator as it was before key building was moved to
+    decoration time (memcache_none handling omitted as only hits are
+    measured)
+    """
+
+    def __init__(self, parent_keys=[], ttl=0, update=False):
+        from google.appengine.api import memcache
+        self.parent_keys = parent_keys
+        self.ttl = ttl
+        self.update = update
+        self.mc = memcache
+
+    def __call__(self, fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            argnames = fn.func_code.co_varnames[:fn.func_code.co_argcount]
+            method = False
+            static = False
+            if len(argnames) > 0:
+                if argnames[0] == 'self' or argnames[0] == 'cls':
+                    method = True
+                    if argnames[0] == 'cls':
+                        static = True
+
+            arg_values_hash = []
+            for i, v in sorted(itertools.chain(itertools.izip(argnames, args), kwargs.iteritems())):
+                if i != 'self':
+                    if i != 'cls':
+                        arg_values_hash.append("%s=%s" % (i, v))
+
+            class_name = None
+            if method:
+                keys = []
+                if len(self.parent_keys) > 0:
+                    for key in self.parent_keys:
+                        keys.append("%s=%s" % (key, getattr(args[0], key)))
+                keys = ','.join(keys)
+                if static:
+                    class_name = args[0].__name__
+                else:
+                    class_name = args[0].__class__.__name__
+                module_name = inspect.getmodule(args[0]).__name__
+                parent_name = "%s.%s[%s]::" % (module_name, class_name, keys)
+            else:
+                parent_name = inspect.getmodule(fn).__name__
+            key = "%s%s(%s)" % (parent_name, fn.__name__, ",".join(arg_values_hash))
+            key = md5(key).hexdigest()
+
+            output = self.mc.get(key)
+            exist = True
+            if not output:
+                exist = False
+                output = fn(*args, **kwargs)
+            if self.update or not exist:
+                if self.ttl is not None:
+                    self.mc.set(key, output, time=self.ttl)
+            return output
+        return wrapper
+
+
+def build_counters():
+
+    """
+    Build instances of classes whose get_total method is cached by each of
+    the decorators being compared
+    """
+
+    from nacelle.decorators.cache import memorise
+
+    class OldCounter(object):
+        name = 'old'
+
+        @old_memorise(parent_keys=['name'])
+        def get_total(self, shard_count, prefix='counter'):
+            return shard_count * 10
+
+    class MemcacheCounter(object):
+        name = 'memcache'
+
+        @memorise(parent_keys=['name'])
+        def get_total(self, shard_count, prefix='counter'):
+            return shard_count * 10
+
+    class LocalCounter(object):
+        name = 'local'
+
+        @memorise(parent_keys=['name'], local_ttl=60)
+        def get_total(self, shard_count, prefix='counter'):
+            return shard_count * 10
+
+    return OldCounter(), MemcacheCounter(), LocalCounter()
+
+
+def main(calls):
+    setup_path()
+    activate_testbed()
+
+    old_counter, memcache_counter, local_counter = build_counters()
+    # prime the caches so that every timed call is a hit
+    for counter in (old_counter, memcache_counter, local_counter):
+        assert counter.get_total(20, prefix='shard') == 200
+
+    def run(counter):
+        get_total = counter.get_total
+        return lambda: get_total(20, prefix='shard')
+
+    print 'Cost per memorise hit (%d calls):' % calls
+    old = bench(run(old_counter), calls)
+    report('old key building + memcache hit', old, calls)
+    report('memcache hit', bench(run(memcache_counter), calls), calls, baseline=old)
+    report('local (L1) hit', bench(run(local_counter), calls), calls, baseline=old)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(DEFAULT_CALLS)
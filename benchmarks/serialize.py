@@ -0,0 +1,112 @@
+"""
+Micro-benchmark comparing the compiled per-model serializers used by
+JSONMixins.get_json with the old db.to_dict/property_to_json path.
+
+Run from the project root (see benchmarks/common.py):
+
+    $ python benchmarks/serialize.py [entity_count]
+"""
+# stdlib imports
+import datetime
+import sys
+
+# local imports
+from common import activate_testbed
+from common import bench
+from common import report
+from common import setup_path
+
+# number of entities serialised per run
+DEFAULT_ENTITY_COUNT = 10000
+
+
+def old_get_json(entity):
+
+    """
+    JSONMixins.get_json (with encode=False) as it was before serializers
+    were compiled per model
+    """
+
+    from google.appengine.ext import db
+    from nacelle.utils.serialize import property_to_json
+
+    # convert entity to dict
+    instance_dict = db.to_dict(entity)
+    # loop over and serialise dict values
+    for key, val in instance_dict.items():
+        instance_dict[key] = property_to_json(val)
+    # serialise entity's key
+    instance_dict['key'] = str(entity.key())
+    return instance_dict
+
+
+def build_entities(count):
+
+    """
+    Build count unsaved entities with a mix of plain, converted and
+    dynamic property values
+    """
+
+    from google.appengine.ext import db
+    from nacelle.models.base import JSONModel
+
+    class BenchmarkEntity(JSONModel):
+        name = db.StringProperty()
+        count = db.IntegerProperty()
+        score = db.FloatProperty()
+        active = db.BooleanProperty()
+        created = db.DateTimeProperty()
+        description = db.TextProperty()
+        location = db.GeoPtProperty()
+        tags = db.StringListProperty()
+        related = db.SelfReferenceProperty()
+
+    created = datetime.datetime(2012, 1, 1, 12, 30)
+    related = db.Key.from_path('BenchmarkEntity', 'related')
+    entities = []
+    for i in xrange(count):
+        entity = BenchmarkEntity(
+            key_name='entity-%d' % i,
+            name='Entity %d' % i,
+            count=i,
+            score=i / 3.0,
+            active=bool(i % 2),
+            created=created + datetime.timedelta(seconds=i),
+            description=db.Text('Description of entity %d' % i),
+            location=db.GeoPt(51.5, -0.1),
+            tags=['tag-%d' % (i % 10), 'tag-%d' % (i % 7)],
+            related=related,
+        )
+        # a dynamic property handled by the fallback converter
+        entity.extra = 'extra %d' % i
+        entities.append(entity)
+    return entities
+
+
+def main(count):
+    setup_path()
+    activate_testbed()
+
+    entities = build_entities(count)
+    # both paths must produce the same output for the timings to mean anything
+    assert old_get_json(entities[0]) == entities[0].get_json(encode=False)
+
+    def run_old():
+        for entity in entities:
+            old_get_json(entity)
+
+    def run_new():
+        for entity in entities:
+            entity.get_json(encode=False)
+
+    print 'Serialising %d entities:' % count
+    old = bench(run_old, 1)
+    report('db.to_dict + property_to_json', old, count)
+    report('compiled serializer', bench(run_new, 1), count, baseline=old)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(DEFAULT_ENTITY_COUNT)
@@ -0,0 +1,115 @@
+"""
+Load benchmark comparing the default secure cookie session backend with
+nacelle.sessions.ServerSessionFactory.  For small sessions, large
+sessions and flash messages it reports the size of the Set-Cookie header
+sent with a write, the size of the Cookie header sent back with every
+following request and the time taken by a write request followed by a
+read request.
+
+Run from the project root (see benchmarks/common.py):
+
+    $ python benchmarks/sessions.py [cycles]
+"""
+# stdlib imports
+import sys
+
+# local imports
+from common import activate_testbed
+from common import bench
+from common import report
+from common import setup_path
+
+# number of write + read request cycles per run
+DEFAULT_CYCLES = 500
+
+# session data written by each scenario
+SMALL_SESSION = {'user_id': 12345}
+LARGE_SESSION = {
+    'user_id': 12345,
+    'basket': [{'sku': 'SKU-%05d' % i, 'quantity': i % 5 + 1, 'note': 'gift wrap'} for i in xrange(40)],
+}
+FLASH_MESSAGES = [
+    'Your changes have been saved',
+    'A confirmation email has been sent to you',
+    'Your basket has been updated',
+]
+
+
+def build_app(session_factory, data, flashes):
+
+    """
+    Build a WSGI app whose handler stores data (and flashes) in the
+    session on POST and reads it back (popping any flashes) on GET
+    """
+
+    import webapp2
+    from nacelle.handlers.base import BaseHandler
+
+    class SessionHandler(BaseHandler):
+
+        def get(self):
+            self.session.get('user_id')
+            if flashes:
+                self.session.get_flashes()
+            self.response.write('OK')
+
+        def post(self):
+            self.session.update(data)
+            for message in flashes:
+                self.session.add_flash(message)
+            self.response.write('OK')
+
+    SessionHandler.session_factory = session_factory
+    config = {'webapp2_extras.sessions': {'secret_key': 'benchmark'}}
+    return webapp2.WSGIApplication([('/', SessionHandler)], config=config)
+
+
+def run_scenario(label, session_factory, data, flashes, cycles):
+
+    """
+    Report the header sizes and time per write + read cycle of one
+    session backend and scenario
+    """
+
+    app = build_app(session_factory, data, flashes)
+    # start a session so that every timed cycle reuses its cookie
+    response = app.get_response('/', method='POST')
+    cookie = response.headers['Set-Cookie'].split(';')[0]
+    headers = {'Cookie': cookie}
+
+    def cycle():
+        write = app.get_response('/', method='POST', headers=headers)
+        assert write.status_int == 200
+        read = app.get_response('/', headers=headers)
+        assert read.status_int == 200
+        return write
+
+    set_cookie = cycle().headers['Set-Cookie']
+    seconds = bench(cycle, cycles)
+    print '%s: Set-Cookie %d bytes, Cookie %d bytes' % (label, len(set_cookie), len(cookie))
+    report('  write + read', seconds, cycles)
+
+
+def main(cycles):
+    setup_path()
+    activate_testbed()
+
+    from nacelle.sessions import ServerSessionFactory
+
+    backends = [('cookie', None), ('server', ServerSessionFactory)]
+    scenarios = [
+        ('small session', SMALL_SESSION, []),
+        ('large session', LARGE_SESSION, []),
+        ('flash messages', SMALL_SESSION, FLASH_MESSAGES),
+    ]
+    print 'Session backends (%d write + read cycles):' % cycles
+    for scenario, data, flashes in scenarios:
+        for backend, session_factory in backends:
+            run_scenario('%s (%s)' % (scenario, backend), session_factory, data, flashes, cycles)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(DEFAULT_CYCLES)
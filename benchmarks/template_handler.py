@@ -0,0 +1,102 @@
+"""
+Benchmark of the per-request overhead of TemplateHandler.get, comparing
+the old behaviour (walking the project tree to rebuild the template
+loaders for every handler instance) with the process-wide template
+directory index.
+
+Run from the project root (see benchmarks/common.py):
+
+    $ python benchmarks/template_handler.py [requests]
+"""
+# stdlib imports
+import os
+import sys
+
+# local imports
+from common import activate_testbed
+from common import bench
+from common import report
+from common import setup_path
+
+# number of requests per run
+DEFAULT_REQUESTS = 500
+# template rendered by the benchmarked handlers
+TEMPLATE = 'welcometonacelle.html'
+
+
+def build_app(handler):
+
+    """
+    Build a WSGI app which routes every request to handler
+    """
+
+    import webapp2
+    import settings
+    return webapp2.WSGIApplication([('/', handler)], debug=False, config=settings.WSGI_CONFIG)
+
+
+def build_handlers():
+
+    """
+    Build a TemplateHandler subclass which behaves as TemplateHandler did
+    before the template directory index was added, and one which uses the
+    current implementation
+    """
+
+    import webapp2
+    from webapp2_extras import jinja2
+    import settings
+    from nacelle.handlers.base import TemplateHandler
+
+    def old_get_template_dirs():
+        # loop over all directories in project
+        for root, dirs, files in os.walk(settings.PROJECT_ROOT):
+            for dirname in dirs:
+                if dirname == 'templates':
+                    yield jinja2.jinja2.FileSystemLoader(os.path.join(root, dirname))
+
+    class OldTemplateHandler(TemplateHandler):
+        template = TEMPLATE
+        use_sessions = False
+
+        @webapp2.cached_property
+        def jinja2(self):
+            # the loaders were rebuilt for every handler instance, even
+            # though the jinja instance itself came from the registry
+            template_loader = jinja2.jinja2.ChoiceLoader(list(old_get_template_dirs()))
+            config = self.get_jinja2_config(template_loader=template_loader)
+            return self.get_jinja2(app=self.app, config=config)
+
+    class NewTemplateHandler(TemplateHandler):
+        template = TEMPLATE
+        use_sessions = False
+
+    return OldTemplateHandler, NewTemplateHandler
+
+
+def main(requests):
+    setup_path()
+    activate_testbed()
+
+    old_handler, new_handler = build_handlers()
+    old_app = build_app(old_handler)
+    new_app = build_app(new_handler)
+    # the first request to each app builds its jinja instance (and the
+    # directory index), which is a one off cost per instance
+    for app in (old_app, new_app):
+        assert app.get_response('/').status_int == 200
+
+    def run(app):
+        return lambda: app.get_response('/')
+
+    print 'TemplateHandler.get overhead (%d requests):' % requests
+    old = bench(run(old_app), requests)
+    report('walk tree per request', old, requests)
+    report('template directory index', bench(run(new_app), requests), requests, baseline=old)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(DEFAULT_REQUESTS)
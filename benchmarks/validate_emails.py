@@ -0,0 +1,122 @@
+"""
+Benchmark comparing email validation of a bulk send's worth of addresses
+with the old uncached validate_email, the cached validate_email and the
+batch validate_emails.
+
+The corpus mimics bulk sends, where a small number of addresses (e.g.
+cc'd staff) turn up again and again alongside a long tail of recipients,
+and includes a small fraction of invalid addresses.
+
+Run from the project root (see benchmarks/common.py):
+
+    $ python benchmarks/validate_emails.py [corpus_size]
+"""
+# stdlib imports
+import random
+import sys
+
+# local imports
+from common import activate_testbed
+from common import bench
+from common import report
+from common import setup_path
+
+# number of addresses validated per run
+DEFAULT_CORPUS_SIZE = 100000
+# number of distinct addresses in the corpus
+DISTINCT_ADDRESSES = 20000
+# fraction of distinct addresses which are invalid
+INVALID_FRACTION = 0.01
+# number of addresses which turn up in many sends, and the fraction of
+# the corpus made up of them
+FREQUENT_ADDRESSES = 50
+FREQUENT_FRACTION = 0.3
+
+DOMAINS = ['gmail.com', 'example.com', 'mail.example.co.uk', 'company.org', 'uni.ac.uk']
+
+
+def old_validate_email(value):
+
+    """
+    validate_email as it was before results were cached
+    """
+
+    from google.appengine.api import mail
+    from nacelle.models.validators import ValidationError
+    from nacelle.models.validators import email_re
+
+    # check that we've actually been passed a value here
+    if value is not None:
+        # validate against the Django email_re above
+        if not email_re.search(value):
+            raise ValidationError('email invalid: %s' % value)
+        # use appengine's own mail validation just to be sure
+        mail.check_email_valid(value, 'email')
+    else:
+        raise ValidationError('email required')
+
+
+def build_corpus(size, seed=0):
+
+    """
+    Build a list of size addresses drawn from DISTINCT_ADDRESSES distinct
+    addresses, a few of which make up a large fraction of the corpus
+    """
+
+    rand = random.Random(seed)
+    addresses = []
+    for i in xrange(DISTINCT_ADDRESSES):
+        address = 'first.last%d@%s' % (i, rand.choice(DOMAINS))
+        if rand.random() < INVALID_FRACTION:
+            address = address.replace('@', ' at ')
+        addresses.append(address)
+    corpus = []
+    for i in xrange(size):
+        if rand.random() < FREQUENT_FRACTION:
+            corpus.append(addresses[rand.randrange(FREQUENT_ADDRESSES)])
+        else:
+            corpus.append(rand.choice(addresses))
+    return corpus
+
+
+def main(size):
+    setup_path()
+    activate_testbed()
+
+    from google.appengine.api import mail
+    from nacelle.models import validators
+
+    corpus = build_corpus(size)
+    print 'Validating %d addresses (%d distinct):' % (size, len(set(corpus)))
+
+    def run_old():
+        for value in corpus:
+            try:
+                old_validate_email(value)
+            except (validators.ValidationError, mail.InvalidEmailError):
+                pass
+
+    def run_cached():
+        # start each run with an empty cache
+        validators._validated_emails.clear()
+        for value in corpus:
+            try:
+                validators.validate_email(value)
+            except (validators.ValidationError, mail.InvalidEmailError):
+                pass
+
+    def run_batch():
+        validators._validated_emails.clear()
+        validators.validate_emails(corpus)
+
+    old = bench(run_old, 1)
+    report('validate_email (uncached)', old, size)
+    report('validate_email (cached)', bench(run_cached, 1), size, baseline=old)
+    report('validate_emails', bench(run_batch, 1), size, baseline=old)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(DEFAULT_CORPUS_SIZE)
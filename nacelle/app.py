@@ -5,27 +5,24 @@ Copyright (C) Patrick Carey 2012
 This is our main WSGI entry point so any initial setup should happen here
 """
 # Add 'lib' and 'apps' dirs to the python path
+import logging
 import os
 import sys
+import time
 
+# time how long it takes to bootstrap a new instance
+BOOTSTRAP_START = time.time()
 
-def find_lib_directories(root):
-
-    """
-    Walk the project tree and find any lib directories so that we can
-    add them to the path before running our app
-    """
-
-    for r, d, f in os.walk(root):
-        for dirname in d:
-            if dirname == 'lib':
-                yield os.path.join(r, dirname)
+# find_lib_directories is still importable from here for backwards compatibility
+from nacelle.bootstrap import find_lib_directories
+from nacelle.bootstrap import get_lib_directories
 
 
 PROJECT_ROOT = os.path.join(os.path.abspath(os.path.dirname(__file__)), os.pardir)
 
-# Find lib directories and add them to the python path
-LIB_DIRS = find_lib_directories(PROJECT_ROOT)
+# Find lib directories (from the prebuilt manifest if available) and
+# add them to the python path
+LIB_DIRS = get_lib_directories(PROJECT_ROOT)
 for directory in LIB_DIRS:
     sys.path.insert(0, directory)
 
@@ -43,3 +40,6 @@ ROUTES = list(itertools.chain.from_iterable(routes.ROUTES))
 
 # Define our WSGI app so GAE can run it
 wsgi = webapp2.WSGIApplication(ROUTES, debug=settings.DEBUG, config=settings.WSGI_CONFIG)
+
+# log the time taken to bootstrap this instance
+logging.info('Nacelle bootstrap completed in %.2fms' % ((time.time() - BOOTSTRAP_START) * 1000))
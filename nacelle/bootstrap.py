@@ -0,0 +1,229 @@
+"""
+Nacelle microframework
+Copyright (C) Patrick Carey 2012
+
+Helpers used to find and add any lib directories to the python path when
+a new instance starts.  Walking the whole project tree is slow so a static
+manifest of lib directories can be generated at build time and will be
+used in preference to the walk whenever it is present and valid.
+
+Generate the manifest from your project root as part of your deploy
+step (it is gitignored as it is specific to the tree it was built from):
+
+    $ python nacelle/bootstrap.py
+
+The manifest stores a fingerprint of the app directories and of any lib
+directories in the places they are usually added (the project root,
+apps/ and each app) and is ignored if they have changed since it was
+built.  Only directories which are deployed are fingerprinted and the
+build checks that the manifest will still match once deployed.
+"""
+# stdlib imports
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+# name of the manifest file stored in the root of the project
+LIB_MANIFEST = 'lib_manifest.json'
+
+# appengine's default skip_files (applied to file and directory names)
+SKIP_FILES_RE = re.compile(r'^(#.*#|.*~|.*\.py[co]|RCS|\..*)$')
+
+
+def find_lib_directories(root):
+
+    """
+    Walk the project tree and find any lib directories so that we can
+    add them to the path before running our app
+    """
+
+    for r, d, f in os.walk(root):
+        for dirname in d:
+            if dirname == 'lib':
+                yield os.path.join(r, dirname)
+
+
+def is_skipped(name):
+
+    """
+    Check whether a file or directory name matches appengine's default
+    skip_files, i.e. whether it is left out when the app is deployed
+    """
+
+    return SKIP_FILES_RE.match(name) is not None
+
+
+def has_deployed_files(directory):
+
+    """
+    Check whether a directory contains any files which will be deployed
+    (appengine doesn't upload empty directories)
+    """
+
+    for r, d, f in os.walk(directory):
+        # don't descend into directories which aren't deployed
+        d[:] = [n for n in d if not is_skipped(n)]
+        for filename in f:
+            if not is_skipped(filename):
+                return True
+    return False
+
+
+def get_tree_fingerprint(root):
+
+    """
+    Build a cheap fingerprint of the names which decide where lib
+    directories are usually found: the app directories and any lib
+    directories in the project root, apps/ and each app.  Directories
+    which aren't deployed (dot-directories and those without any files)
+    are ignored so that a manifest built in a checkout still matches
+    once deployed.
+    """
+
+    directories = [root]
+    apps_dir = os.path.join(root, 'apps')
+    app_names = []
+    if os.path.isdir(apps_dir):
+        directories.append(apps_dir)
+        for name in sorted(os.listdir(apps_dir)):
+            app_dir = os.path.join(apps_dir, name)
+            if os.path.isdir(app_dir) and not is_skipped(name) and has_deployed_files(app_dir):
+                app_names.append(name)
+                directories.append(app_dir)
+
+    fingerprint = hashlib.md5()
+    fingerprint.update('apps:%s\n' % ','.join(app_names))
+    for directory in directories:
+        lib_dir = os.path.join(directory, 'lib')
+        if os.path.isdir(lib_dir) and has_deployed_files(lib_dir):
+            fingerprint.update('lib:%s\n' % os.path.relpath(lib_dir, root))
+    return fingerprint.hexdigest()
+
+
+def load_lib_manifest(root):
+
+    """
+    Load the list of lib directories from a prebuilt manifest.  Returns
+    None if the manifest is missing, unreadable or stale (i.e. the
+    project's directories have changed since it was built or it refers
+    to a directory which no longer exists).
+    """
+
+    manifest_path = os.path.join(root, LIB_MANIFEST)
+    # no manifest has been built for this project
+    if not os.path.exists(manifest_path):
+        return None
+
+    try:
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        relative_dirs = manifest['lib_dirs']
+        fingerprint = manifest['fingerprint']
+    except (IOError, ValueError, KeyError, TypeError):
+        logging.warning('Unable to read lib manifest: %s' % manifest_path)
+        return None
+
+    # lib directories may have been added since the manifest was built
+    if fingerprint != get_tree_fingerprint(root):
+        logging.warning('Stale lib manifest, project directories have changed: %s' % manifest_path)
+        return None
+
+    lib_dirs = [os.path.join(root, d) for d in relative_dirs]
+    # treat the manifest as stale if any listed directory has gone away
+    for directory in lib_dirs:
+        if not os.path.isdir(directory):
+            logging.warning('Stale lib manifest, missing directory: %s' % directory)
+            return None
+    return lib_dirs
+
+
+def get_lib_directories(root):
+
+    """
+    Return a list of lib directories, using the prebuilt manifest where
+    possible and falling back to walking the project tree otherwise
+    """
+
+    lib_dirs = load_lib_manifest(root)
+    if lib_dirs is None:
+        lib_dirs = list(find_lib_directories(root))
+    return lib_dirs
+
+
+def is_deployed(root, directory):
+
+    """
+    Check whether a directory within the project will be deployed
+    """
+
+    relative_path = os.path.relpath(directory, root)
+    if any(is_skipped(name) for name in relative_path.split(os.sep)):
+        return False
+    return has_deployed_files(directory)
+
+
+def check_lib_manifest(root):
+
+    """
+    Check that the project's manifest is accepted by a tree laid out the
+    way appengine deploys it (without skipped files, dot-directories or
+    empty directories).  The layout is mirrored in a temporary directory
+    using empty placeholder files.
+    """
+
+    deployed_root = tempfile.mkdtemp()
+    try:
+        for r, d, f in os.walk(root):
+            d[:] = [n for n in d if not is_skipped(n)]
+            filenames = [n for n in f if not is_skipped(n)]
+            if not filenames:
+                continue
+            deployed_dir = os.path.join(deployed_root, os.path.relpath(r, root))
+            if not os.path.isdir(deployed_dir):
+                os.makedirs(deployed_dir)
+            for filename in filenames:
+                if filename == LIB_MANIFEST and r == root:
+                    shutil.copy(os.path.join(r, filename), deployed_dir)
+                else:
+                    open(os.path.join(deployed_dir, filename), 'w').close()
+        return load_lib_manifest(deployed_root) is not None
+    finally:
+        shutil.rmtree(deployed_root)
+
+
+def build_lib_manifest(root):
+
+    """
+    Walk the project tree and write a manifest listing all lib
+    directories (relative to the project root)
+    """
+
+    # build relative paths so the manifest stays valid wherever the
+    # project is deployed, leaving out any directories which won't be
+    lib_dirs = [os.path.relpath(d, root) for d in find_lib_directories(root)
+                if is_deployed(root, d)]
+    manifest_path = os.path.join(root, LIB_MANIFEST)
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump({'lib_dirs': lib_dirs, 'fingerprint': get_tree_fingerprint(root)}, manifest_file, indent=4)
+    return manifest_path, lib_dirs
+
+
+if __name__ == '__main__':
+    # allow a project root to be passed on the command line, otherwise
+    # assume we live in <project root>/nacelle
+    if len(sys.argv) > 1:
+        project_root = os.path.abspath(sys.argv[1])
+    else:
+        project_root = os.path.join(os.path.abspath(os.path.dirname(__file__)), os.pardir)
+        project_root = os.path.abspath(project_root)
+    manifest_path, lib_dirs = build_lib_manifest(project_root)
+    print 'Wrote %d lib directories to %s' % (len(lib_dirs), manifest_path)
+    # make sure deployed instances won't treat the manifest as stale
+    if not check_lib_manifest(project_root):
+        print 'Manifest does not match the deployed layout of %s' % project_root
+        sys.exit(1)
@@ -0,0 +1,73 @@
+"""
+Nacelle microframework
+Copyright (C) Patrick Carey 2012
+
+Build step which precompiles every template found in the project's
+template directories into a single zip bundle.  Loading templates from
+this bundle means new instances don't have to parse and compile each
+template on first use.
+
+Run from your project root before deploying (webapp2 and jinja2 must be
+importable, e.g. from the appengine SDK):
+
+    $ python nacelle/compile_templates.py [output_path]
+
+Then set TEMPLATE_COMPILED_PATH in settings.py to the generated bundle.
+"""
+# stdlib imports
+import os
+import sys
+
+# default bundle location (relative to the project root)
+DEFAULT_OUTPUT = 'templates_compiled.zip'
+
+
+def setup_path(project_root):
+
+    """
+    Add the project root, its lib directories and the apps directory to
+    the python path, mirroring the setup performed in nacelle/app.py
+    """
+
+    sys.path.insert(0, project_root)
+    from nacelle.bootstrap import get_lib_directories
+    for directory in get_lib_directories(project_root):
+        sys.path.insert(0, directory)
+    sys.path.insert(0, os.path.join(project_root, 'apps'))
+
+
+def compile_templates(output_path):
+
+    """
+    Compile all of the project's templates into a zip bundle at output_path
+    using the same jinja configuration as TemplateMixins
+    """
+
+    # third-party imports
+    import webapp2
+    from webapp2_extras import jinja2
+
+    # local imports
+    from nacelle.handlers.mixins import TemplateMixins
+
+    # always compile from source, even if a bundle is already configured
+    mixins = TemplateMixins()
+    template_loader = jinja2.jinja2.ChoiceLoader(list(mixins.get_template_dirs()))
+    config = mixins.get_jinja2_config(template_loader=template_loader)
+    # build a jinja instance configured exactly as it will be at runtime
+    renderer = jinja2.Jinja2(webapp2.WSGIApplication(debug=True), config)
+    # fail loudly rather than shipping a bundle with missing templates
+    renderer.environment.compile_templates(output_path, zip='deflated', ignore_errors=False)
+    return template_loader.list_templates()
+
+
+if __name__ == '__main__':
+    project_root = os.path.join(os.path.abspath(os.path.dirname(__file__)), os.pardir)
+    project_root = os.path.abspath(project_root)
+    setup_path(project_root)
+    if len(sys.argv) > 1:
+        output_path = os.path.abspath(sys.argv[1])
+    else:
+        output_path = os.path.join(project_root, DEFAULT_OUTPUT)
+    templates = compile_templates(output_path)
+    print 'Compiled %d templates to %s' % (len(templates), output_path)
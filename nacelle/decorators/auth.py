@@ -6,7 +6,7 @@ control to a handler method
 from google.appengine.api import users
 
 # local imports
-from nacelle.models.auth import AdminUser
+from nacelle.models.auth import is_admin_email
 from nacelle.decorators.well_behaved import well_behaved
 
 
@@ -49,16 +49,14 @@ def admin_required(func):
 
         # get current user object
         user = users.get_current_user()
-        # get any configured AdminUser emails
-        admin_emails = [u.email for u in AdminUser.all()]
 
         # check if user is logged in
         if user:
             # check if user is registered appengine admin
             if users.is_current_user_admin():
                 return func(self, *args, **kwargs)
-            # check if user is registered AdminUser
-            elif user.email() in admin_emails:
+            # check if user is registered AdminUser (cached)
+            elif is_admin_email(user.email()):
                 return func(self, *args, **kwargs)
             # otherwise abort with 403
             else:
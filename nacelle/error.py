@@ -9,8 +9,31 @@ import pprint
 import traceback
 import os
 import base64
+import linecache
+import repr as reprlib
 from StringIO import StringIO
 
+import settings
+
+# maximum number of characters of each value shown on the error page
+MAX_REPR_LENGTH = 4096
+# maximum number of variables shown per table in truncated mode
+MAX_LOCALS = 50
+# number of source lines shown either side of each frame's current line
+CONTEXT_LINES = 7
+# In truncated mode values are rendered with size limited reprs (so huge
+# locals are never fully formatted) and long variable tables are cut
+# short, keeping error pages cheap to render even with DEBUG on
+TRUNCATE_LOCALS = getattr(settings, 'DEBUG_TRUNCATE_LOCALS', True)
+
+_truncated_repr = reprlib.Repr()
+_truncated_repr.maxlevel = 3
+_truncated_repr.maxdict = 20
+_truncated_repr.maxlist = _truncated_repr.maxtuple = 20
+_truncated_repr.maxset = _truncated_repr.maxfrozenset = 20
+_truncated_repr.maxdeque = _truncated_repr.maxarray = 20
+_truncated_repr.maxstring = _truncated_repr.maxother = MAX_REPR_LENGTH
+
 whereami = os.path.join(os.getcwd(), __file__)
 whereami = os.path.sep.join(whereami.split(os.path.sep)[:-1])
 
@@ -34,27 +57,34 @@ def dicttable(d, kls='req', id=None):
 
 
 def dicttable_items(items, kls='req', id=None):
-    output = ''
+    output = []
 
     if items:
-        output += '<table class="%s"' % kls
+        output.append('<table class="%s"' % kls)
         if id:
-            output += 'id="%s"' % id
-        output += '><thead><tr><th>Variable</th><th>Value</th></tr></thead><tbody>'
+            output.append('id="%s"' % id)
+        output.append('><thead><tr><th>Variable</th><th>Value</th></tr></thead><tbody>')
+
+        hidden = 0
+        if TRUNCATE_LOCALS and len(items) > MAX_LOCALS:
+            hidden = len(items) - MAX_LOCALS
+            items = items[:MAX_LOCALS]
 
         for k, v in items:
             try:
-                output += '<tr><td>%s</td><td class="code"><div>%s</div></td></tr>' \
-                          % (k, prettify(v))
+                output.append('<tr><td>%s</td><td class="code"><div>%s</div></td></tr>'
+                              % (k, prettify(v)))
             except UnicodeDecodeError:
-                output += '<tr><td>%s (in base 64)</td><td class="code"><div>%s</div></td></tr>' \
-                          % (k, base64.b64encode(v))
+                output.append('<tr><td>%s (in base 64)</td><td class="code"><div>%s</div></td></tr>'
+                              % (k, _truncate(base64.b64encode(v))))
 
-        output += '</tbody></table>'
+        if hidden:
+            output.append('<tr><td colspan="2">... %d more not shown</td></tr>' % hidden)
+        output.append('</tbody></table>')
     else:
-        output += '<p>No data.</p>'
+        output.append('<p>No data.</p>')
 
-    return output
+    return ''.join(output)
 
 
 def dicttable_txt(d, tabbing):
@@ -73,43 +103,56 @@ def dicttable_items_txt(items, tabbing):
         v = items[i][1]
 
         try:
-            formatted_items.append([k, unicode(v)])
+            formatted_items.append([k, _truncate(unicode(v))])
         except UnicodeDecodeError:
             k += ' (in base 64)'
-            formatted_items.append([k, base64.b32encode(v)])
+            formatted_items.append([k, _truncate(base64.b32encode(v))])
 
         if len(k) > max_key_length:
             max_key_length = len(k)
 
     tabbing = ' ' * tabbing
-    output = ''
+    output = []
 
     for k, v in formatted_items:
         spaces = ' ' * (max_key_length - len(k))
-        output += '%s%s%s = %s\n' % (tabbing, k, spaces, v)
+        output.append('%s%s%s = %s\n' % (tabbing, k, spaces, v))
+
+    return ''.join(output)
 
-    return output
+
+def _truncate(out):
+    if len(out) > MAX_REPR_LENGTH:
+        out = out[:MAX_REPR_LENGTH] + '... (truncated)'
+    return out
 
 
 def prettify(x):
     try:
-        out = pprint.pformat(unicode(x))
+        if TRUNCATE_LOCALS:
+            out = _truncated_repr.repr(x)
+        else:
+            out = pprint.pformat(unicode(x))
     except UnicodeDecodeError, e:
         raise e
     except Exception, e:
         out = '[could not display: <' + e.__class__.__name__ + \
               ': ' + str(e) + '>]'
-    return out
+    return _truncate(out)
 
 
-def _get_lines_from_file(filename, lineno, context_lines):
+def _get_lines_from_file(filename, lineno, context_lines, module_globals=None):
     """
     Returns context_lines before and after lineno from file.
     Returns (pre_context_lineno, pre_context, context_line, post_context).
+    Source files are read through linecache so each file is only read
+    once however many frames (or errors) refer to it.
     """
 
     try:
-        source = open(filename).readlines()
+        source = linecache.getlines(filename, module_globals)
+        if not source:
+            return None, [], None, []
         lower_bound = max(0, lineno - context_lines)
         upper_bound = lineno + context_lines
 
@@ -120,7 +163,7 @@ def _get_lines_from_file(filename, lineno, context_lines):
             [line.strip('\n') for line in source[lineno + 1:upper_bound]]
 
         return lower_bound, pre_context, context_line, post_context
-    except (OSError, IOError):
+    except (OSError, IOError, IndexError):
         return None, [], None, []
 
 
@@ -135,7 +178,7 @@ def _get_frames(tback, is_debug):
         function = tback.tb_frame.f_code.co_name
         lineno = tback.tb_lineno - 1
         pre_context_lineno, pre_context, context_line, post_context = \
-            _get_lines_from_file(filename, lineno, 7)
+            _get_lines_from_file(filename, lineno, CONTEXT_LINES, tback.tb_frame.f_globals)
 
         frame = BaseObject()
         frame.tback = tback
@@ -3,15 +3,30 @@ A collection of nacelle handlers which are useful
 for building RESTful(ish) APIs
 """
 # stdlib imports
+import hashlib
 import json
 import logging
 
+# third-party imports
+import webapp2
+
 # appengine SDK imports
 from google.appengine.api import memcache
 from google.appengine.ext import db
 
 # local imports
 from nacelle.handlers.base import JSONHandler
+from nacelle.utils import uniqify
+from nacelle.utils.cache import CacheEntry
+from nacelle.utils.cache import bump_generation
+from nacelle.utils.cache import get_cache_stats
+from nacelle.utils.cache import get_generation
+from nacelle.utils.cache import get_generation_key
+from nacelle.utils.cache import get_or_compute
+from nacelle.utils.cache import record_cache_stat
+from nacelle.utils.cache import resolve
+from nacelle.utils.queryspec import InvalidQuery
+from nacelle.utils.queryspec import get_query_spec
 from unidecode import unidecode
 
 
@@ -31,7 +46,18 @@ class FixedQueryAPIHandler(JSONHandler):
     page_size = 20
     # specify the amount of time to cache all GET requests to
     # this handler. Set to any boolean value of False to disable.
+    # Cached values are invalidated by any POST or DELETE requests
+    # so longer cache times are safe for write-enabled handlers.
     cache = 60
+    # maximum number of keys which can be requested at once
+    # via the keys= query param
+    max_keys = 100
+    # write list responses entity by entity rather than building the
+    # whole page in memory before serialising it.  This reduces peak
+    # memory use for large pages (the response itself is still buffered
+    # by the runtime).  When cache is also enabled, each newly written
+    # page is read back from the response once and cached.
+    stream = False
     # list of HTTP methods to allow for this handler
     # Accepts GET, POST, and DELETE
     allowed_methods = ['GET']
@@ -45,6 +71,53 @@ class FixedQueryAPIHandler(JSONHandler):
 
         pass
 
+    def get_cache_namespace(self):
+
+        """
+        Return the namespace whose cache generation is folded into all of
+        this handler's cache keys. Writes to the handler's model bump the
+        generation, invalidating every cached page and entity at once.
+        """
+
+        if self.model is not None:
+            return self.model.kind()
+        return self.__class__.__name__
+
+    @webapp2.cached_property
+    def cache_generation(self):
+
+        """
+        Current cache generation for this handler (fetched once per request)
+        """
+
+        return get_generation(self.get_cache_namespace())
+
+    @property
+    def cache_key_generation(self):
+
+        """
+        Generation folded into this handler's cache keys
+        """
+
+        return self.cache_generation
+
+    def invalidate_cache(self):
+
+        """
+        Invalidate all cached pages and entities for this handler's model
+        """
+
+        bump_generation(self.get_cache_namespace())
+
+    @classmethod
+    def cache_stats(cls):
+
+        """
+        Return page cache hit/miss counts for this handler
+        """
+
+        return get_cache_stats(cls.__name__)
+
     def get_cache_key(self, query, page_size, cursor):
 
         """
@@ -52,9 +125,17 @@ class FixedQueryAPIHandler(JSONHandler):
         """
 
         # build and return key
-        cache_key = '%s-%s-%s' % (self.__class__.__name__, page_size or str(page_size), str(cursor))
+        cache_key = '%s-%s-%s-%s' % (self.__class__.__name__, self.cache_key_generation, page_size or str(page_size), str(cursor))
         return cache_key
 
+    def get_entity_cache_key(self, key):
+
+        """
+        Build and return a cache key for storing a single entity in memcache
+        """
+
+        return 'entity-%s-%s' % (self.cache_key_generation, key)
+
     def get_next_page(self, query, page_size, cursor):
 
         """
@@ -66,32 +147,12 @@ class FixedQueryAPIHandler(JSONHandler):
         next_page = "%s?page_size=%s&cursor=%s" % (self.request.path, str(page_size), cursor)
         return next_page
 
-    def get_context(self):
+    def build_page(self, query, page_size, cursor):
 
         """
-        Build and return query page for JSON response
+        Run the list query and build a page of results
         """
 
-        # get page size from query params or use default
-        page_size = self.request.GET.get('page_size', None) or self.page_size
-        # get cursor from query params if specified
-        cursor = self.request.GET.get('cursor', None)
-        # get query to use
-        query = self.get_query()
-
-        if self.cache:
-            # build cache key
-            cache_key = self.get_cache_key(query, page_size, cursor)
-            # check if response has been cached
-            cached_response = memcache.get(cache_key)
-            if cached_response is not None:
-                # return cached response
-                logging.info('Cache hit: %s' % cache_key)
-                return cached_response
-            else:
-                # log the cache miss
-                logging.info('Cache miss: %s' % cache_key)
-
         if cursor is None:
             # run query without cursor
             entities = query.fetch(int(page_size))
@@ -110,15 +171,137 @@ class FixedQueryAPIHandler(JSONHandler):
         # get number of entities on page
         page_size = len(entities)
 
-        # build response object
-        response = {'entities': entities, 'next_page': next_page, 'page_size': page_size}
+        # build and return response object
+        return {'entities': entities, 'next_page': next_page, 'page_size': page_size}
 
-        if self.cache:
-            # cache response if enabled
-            memcache.set(cache_key, response, self.cache)
+    def get_context(self):
+
+        """
+        Build and return query page for JSON response
+        """
+
+        # get page size from query params or use default
+        page_size = self.request.GET.get('page_size', None) or self.page_size
+        # get cursor from query params if specified
+        cursor = self.request.GET.get('cursor', None)
+        # get query to use
+        query = self.get_query()
+
+        if not self.cache:
+            return self.build_page(query, page_size, cursor)
+
+        # build cache key
+        cache_key = self.get_cache_key(query, page_size, cursor)
+        missed = []
+
+        def compute():
+            # log the cache miss
+            logging.info('Cache miss: %s' % cache_key)
+            missed.append(cache_key)
+            return self.build_page(query, page_size, cursor)
+
+        # get cached response, only one request rebuilds an expired
+        # page while the others serve the stale page
+        context = get_or_compute(cache_key, compute, self.cache)
+        record_cache_stat(self.__class__.__name__, not missed)
+        return context
+
+    def write_page(self, query, page_size, cursor, keep=False):
+
+        """
+        Run the list query and write the JSON response element by element
+        as the query is iterated, so that the page's entities and their
+        serialised dicts are never all held in memory at once (the
+        python27 runtime still buffers the whole response before sending
+        it, so this doesn't reduce time to first byte).  The response
+        envelope is identical to that built by build_page().  If keep is
+        True the encoded response is also returned so that it can be
+        cached.  If anything fails part way through, the partially
+        written response is discarded before the error is raised.
+        """
+
+        # set the right content-type header
+        self.response.headers['Content-Type'] = 'application/json'
+
+        if cursor is not None:
+            # run query from cursor
+            query = query.with_cursor(cursor)
+
+        try:
+            # write each entity out as soon as it has been serialised
+            self.response.write('{"entities": [')
+            count = 0
+            for entity in query.run(limit=int(page_size), batch_size=int(page_size)):
+                if count:
+                    self.response.write(', ')
+                self.response.write(json.dumps(entity.get_json(encode=False)))
+                count += 1
+
+            # get cursor string and build next page url
+            cursor = query.cursor()
+            next_page = self.get_next_page(query, page_size, cursor)
+            self.response.write('], "next_page": %s, "page_size": %d}' % (json.dumps(next_page), count))
+        except Exception:
+            # don't leave half a JSON document in front of the error
+            self.response.clear()
+            raise
+
+        if keep:
+            # joins the written chunks once, rather than keeping a
+            # second copy of each chunk as it's written
+            return self.response.body
+
+    def stream_context(self):
+
+        """
+        Stream the list query's results to the response, serving
+        the encoded page from memcache when cached
+        """
+
+        # get page size from query params or use default
+        page_size = self.request.GET.get('page_size', None) or self.page_size
+        # get cursor from query params if specified
+        cursor = self.request.GET.get('cursor', None)
+        # get query to use
+        query = self.get_query()
+
+        if not self.cache:
+            return self.write_page(query, page_size, cursor)
+
+        # build cache key
+        cache_key = self.get_cache_key(query, page_size, cursor)
+        streamed = []
+
+        def compute():
+            # log the cache miss
+            logging.info('Cache miss: %s' % cache_key)
+            streamed.append(True)
+            return self.write_page(query, page_size, cursor, keep=True)
+
+        response = get_or_compute(cache_key, compute, self.cache)
+        record_cache_stat(self.__class__.__name__, not streamed)
+        if not streamed:
+            # return cached (encoded) response
+            self.json_response(response)
+
+    def cache_entities(self, entities):
+
+        """
+        Store a dict of encoded keys to entities in memcache
+        """
+
+        key_prefix = self.get_entity_cache_key('')
+        memcache.set_multi(entities, self.cache, key_prefix=key_prefix)
+
+    def get_cached_entities(self, keys):
+
+        """
+        Return a dict of encoded keys to any of the given entities
+        which are cached in memcache
+        """
 
-        # return dict for serialisation
-        return response
+        key_prefix = self.get_entity_cache_key('')
+        return memcache.get_multi(keys, key_prefix=key_prefix)
 
     def get_single_entity(self, key):
 
@@ -127,21 +310,69 @@ class FixedQueryAPIHandler(JSONHandler):
         """
 
         # check if cached
-        obj = memcache.get(key)
+        obj = self.get_cached_entities([key]).get(key) if self.cache else None
         # get from datastore if not cached
         if obj is None:
             logging.info('Cache miss: %s' % key)
             obj = db.get(db.Key(encoded=key))
+            # only backfill the cache on a miss
+            if self.cache and isinstance(obj, self.model):
+                self.cache_entities({key: obj})
         else:
             logging.info('Cache hit: %s' % key)
         # throw 404 if retrieved object is not of type self.model
         if not isinstance(obj, self.model):
             self.abort(404)
-        if self.cache:
-            memcache.set(key, obj, self.cache)
         obj = obj.get_json()
         return obj
 
+    def get_multiple_entities(self, keys):
+
+        """
+        Retrieve multiple entities from the datastore by encoded key
+        using one batched memcache lookup, one batched datastore get for
+        any cache misses and one batched memcache set to backfill the cache
+        """
+
+        # sanitise key strings and drop any duplicates
+        keys = uniqify([k.replace('key:', '') for k in keys if k])
+        if not keys or len(keys) > self.max_keys:
+            self.abort(400)
+
+        # check which entities are cached
+        if self.cache:
+            entities = self.get_cached_entities(keys)
+        else:
+            entities = {}
+        uncached_keys = [k for k in keys if k not in entities]
+        logging.info('Cache hits: %d, misses: %d' % (len(entities), len(uncached_keys)))
+
+        # get any uncached entities from the datastore
+        if uncached_keys:
+            try:
+                db_keys = [db.Key(encoded=k) for k in uncached_keys]
+            except db.BadKeyError:
+                self.abort(400)
+            fetched = {}
+            for key, obj in zip(uncached_keys, db.get(db_keys)):
+                if isinstance(obj, self.model):
+                    fetched[key] = obj
+            if self.cache and fetched:
+                self.cache_entities(fetched)
+            entities.update(fetched)
+
+        # return found entities in the requested order along with
+        # any keys which could not be found
+        found = []
+        missing = []
+        for key in keys:
+            obj = entities.get(key)
+            if isinstance(obj, self.model):
+                found.append(obj.get_json(encode=False))
+            else:
+                missing.append(key)
+        return {'entities': found, 'missing': missing, 'page_size': len(found)}
+
     def get(self, key=None):
 
         """
@@ -152,6 +383,14 @@ class FixedQueryAPIHandler(JSONHandler):
         if key is not None:
             entity = self.get_single_entity(key)
             return self.json_response(entity)
+        # return multiple keys in one batch
+        if 'keys' in self.request.GET:
+            keys = self.request.GET.get('keys').split(',')
+            context = self.get_multiple_entities(keys)
+            return self.json_response(context)
+        # write response as the query is iterated if streaming
+        if self.stream:
+            return self.stream_context()
         # build response object
         context = self.get_context()
         # return JSON response
@@ -182,6 +421,8 @@ class FixedQueryAPIHandler(JSONHandler):
             obj.set_json(self.request.body)
             # save entity
             obj.put()
+            # invalidate any cached pages/entities
+            self.invalidate_cache()
             # return entity
             new_entity = obj.get_json()
         else:
@@ -193,6 +434,8 @@ class FixedQueryAPIHandler(JSONHandler):
             new_entity.set_json(posted_entity)
             # save entity
             new_entity.put()
+            # invalidate any cached pages
+            self.invalidate_cache()
             # get JSON repr of new entity
             new_entity = new_entity.get_json(encode=False)
         # return newly created/updated entity
@@ -223,6 +466,8 @@ class FixedQueryAPIHandler(JSONHandler):
         except AttributeError:
             # throw 404 if entity doesn't exist
             self.abort(404)
+        # invalidate any cached pages/entities
+        self.invalidate_cache()
         # return 200 OK
         self.json_response({'status': '200 OK'})
 
@@ -260,47 +505,33 @@ class DynamicQueryAPIHandler(FixedQueryAPIHandler):
         # return value if string
         return value
 
+    @webapp2.cached_property
+    def query_spec(self):
+
+        """
+        Parsed and validated query spec built from GET params
+        """
+
+        try:
+            spec = get_query_spec(
+                self.request.GET.getall('filter'),
+                self.request.GET.getall('order'),
+                self.normalise_value,
+            )
+            # reject queries the datastore can't run before running them
+            spec.validate(self.model.kind())
+        except InvalidQuery, e:
+            self.abort(400, detail=str(e))
+        return spec
+
     def build_query(self):
 
         """
         Build a datastore query from GET params
         """
 
-        # Define our base query
-        query = self.model.all()
-
-        # Add any filters to our query
-        if 'filter' in self.request.GET:
-            filter_params = self.request.GET.getall('filter')
-            for filter_param in filter_params:
-                if '__lt__' in filter_param:
-                    key, val = filter_param.split('__lt__')
-                    val = self.normalise_value(val)
-                    query = query.filter('%s <' % key, val)
-                elif '__gt__' in filter_param:
-                    key, val = filter_param.split('__gt__')
-                    val = self.normalise_value(val)
-                    query = query.filter('%s >' % key, val)
-                elif '__lte__' in filter_param:
-                    key, val = filter_param.split('__lte__')
-                    val = self.normalise_value(val)
-                    query = query.filter('%s <=' % key, val)
-                elif '__gte__' in filter_param:
-                    key, val = filter_param.split('__gte__')
-                    val = self.normalise_value(val)
-                    query = query.filter('%s >=' % key, val)
-                elif '__' in filter_param:
-                    key, val = filter_param.split('__')
-                    val = self.normalise_value(val)
-                    query = query.filter('%s =' % key, val)
-                else:
-                    self.abort(400)
-        # order the results of our query
-        if 'order' in self.request.GET:
-            order_params = self.request.GET.getall('order')
-            for order_param in order_params:
-                query = query.order(order_param)
-        return query
+        # Define our base query and add any filters and sort orders to it
+        return self.query_spec.apply(self.model.all())
 
     def get_cache_key(self, query, page_size, cursor):
 
@@ -308,20 +539,13 @@ class DynamicQueryAPIHandler(FixedQueryAPIHandler):
         Build and return a cache key for storing a response in memcache
         """
 
-        # build initial cache key
-        cache_key = '%s-%s-%s' % (self.__class__.__name__, page_size or str(page_size), str(cursor))
-        # add any filter params to cache key
-        if 'filter' in self.request.GET:
-            filter_params = self.request.GET.getall('filter')
-            for filter_param in filter_params:
-                cache_key = cache_key + '&filter=%s' % unidecode(filter_param)
-        # add any order params to cache key
-        if 'order' in self.request.GET:
-            order_params = self.request.GET.getall('order')
-            for order_param in order_params:
-                cache_key = cache_key + '&order=%s' % unidecode(order_param)
-        # return newly built cache key
-        return cache_key
+        # equivalent queries share a canonical spec whatever order their
+        # filters were given in.  Hash it along with the page details so
+        # that long queries and cursors stay within memcache's key limit.
+        query_hash = hashlib.md5(
+            (u'%s|%s|%s' % (page_size, cursor, self.query_spec.canonical)).encode('utf-8')
+        ).hexdigest()
+        return '%s-%s-%s' % (self.__class__.__name__, self.cache_key_generation, query_hash)
 
     def get_next_page(self, query, page_size, cursor):
 
@@ -353,3 +577,162 @@ class DynamicQueryAPIHandler(FixedQueryAPIHandler):
 
         query = self.build_query()
         return query
+
+
+class AsyncFixedQueryAPIHandler(FixedQueryAPIHandler):
+
+    """
+    A variant of FixedQueryAPIHandler which uses the SDK's async memcache
+    API to cut RPCs from the request path.  Cached pages and entities are
+    stored along with the cache generation they were built under rather
+    than having the generation folded into their keys, so the generation
+    and the cached values are fetched together in a single memcache call.
+    The page probe is started before the query is prepared (so
+    get_cache_key() is passed None for the query) and cache writes are
+    made in the background rather than blocking the response.
+    """
+
+    # generations are checked against cached values instead (see above)
+    cache_key_generation = 'g'
+
+    @webapp2.cached_property
+    def memcache_client(self):
+
+        """
+        memcache client used for async calls during this request
+        """
+
+        return memcache.Client()
+
+    def probe_cache(self, cache_keys):
+
+        """
+        Start fetching the current cache generation along with the given
+        keys.  Returns a function which waits for the results and returns
+        a dict of the keys' values which were cached under the current
+        generation (values are stored as (generation, value) tuples).
+        """
+
+        generation_key = get_generation_key(self.get_cache_namespace())
+        rpc = self.memcache_client.get_multi_async([generation_key] + cache_keys)
+
+        def get_result():
+            cached = rpc.get_result()
+            generation = cached.pop(generation_key, None)
+            if generation is None:
+                # no generation yet (or it was evicted) so start a new one
+                generation = get_generation(self.get_cache_namespace())
+            self.__dict__['cache_generation'] = generation
+            # discard anything cached under an older generation
+            results = {}
+            for key, value in cached.items():
+                if isinstance(value, CacheEntry):
+                    current = isinstance(value.value, tuple) and value.value[0] == generation
+                else:
+                    current = isinstance(value, tuple) and value[0] == generation
+                if current:
+                    results[key] = value
+            return results
+        return get_result
+
+    def get_cached_page(self, build):
+
+        """
+        Return the cached page for this request (or build(query, page_size,
+        cursor)'s result on a miss), recording a cache hit or miss
+        """
+
+        # get page size from query params or use default
+        page_size = self.request.GET.get('page_size', None) or self.page_size
+        # get cursor from query params if specified
+        cursor = self.request.GET.get('cursor', None)
+
+        # start the cache probe and prepare the query while it's in flight
+        cache_key = self.get_cache_key(None, page_size, cursor)
+        get_result = self.probe_cache([cache_key])
+        query = self.get_query()
+        entry = get_result().get(cache_key)
+
+        missed = []
+
+        def compute():
+            # log the cache miss
+            logging.info('Cache miss: %s' % cache_key)
+            missed.append(cache_key)
+            return (self.cache_generation, build(query, page_size, cursor))
+
+        def is_current(value):
+            # pages stored by other requests while we wait for their
+            # lease may have been built under an older generation
+            return isinstance(value, tuple) and value[0] == self.cache_generation
+
+        # return cached response without waiting for any cache write
+        generation, page = resolve(cache_key, entry, compute, self.cache, client=self.memcache_client, wait=False, is_valid=is_current)
+        record_cache_stat(self.__class__.__name__, not missed, client=self.memcache_client, wait=False)
+        return page, bool(missed)
+
+    def get_context(self):
+
+        """
+        Build and return query page for JSON response
+        """
+
+        if not self.cache:
+            return super(AsyncFixedQueryAPIHandler, self).get_context()
+        return self.get_cached_page(self.build_page)[0]
+
+    def stream_context(self):
+
+        """
+        Stream the list query's results to the response, serving
+        the encoded page from memcache when cached
+        """
+
+        if not self.cache:
+            return super(AsyncFixedQueryAPIHandler, self).stream_context()
+
+        def build(query, page_size, cursor):
+            return self.write_page(query, page_size, cursor, keep=True)
+
+        response, streamed = self.get_cached_page(build)
+        if not streamed:
+            # return cached (encoded) response
+            self.json_response(response)
+
+    def get_cached_entities(self, keys):
+
+        """
+        Return a dict of encoded keys to any of the given entities which
+        are cached under the current generation, fetching the generation
+        and the entities in a single memcache call
+        """
+
+        key_prefix = self.get_entity_cache_key('')
+        cached = self.probe_cache([key_prefix + key for key in keys])()
+        entities = {}
+        for key in keys:
+            if key_prefix + key in cached:
+                entities[key] = cached[key_prefix + key][1]
+        return entities
+
+    def cache_entities(self, entities):
+
+        """
+        Store a dict of encoded keys to entities in memcache along with
+        the current generation without waiting for the write to complete
+        """
+
+        key_prefix = self.get_entity_cache_key('')
+        generation = self.cache_generation
+        values = dict((key, (generation, obj)) for key, obj in entities.items())
+        self.memcache_client.set_multi_async(values, time=self.cache, key_prefix=key_prefix)
+
+
+class AsyncDynamicQueryAPIHandler(AsyncFixedQueryAPIHandler, DynamicQueryAPIHandler):
+
+    """
+    A variant of DynamicQueryAPIHandler which uses the SDK's async
+    memcache API (see AsyncFixedQueryAPIHandler)
+    """
+
+    pass
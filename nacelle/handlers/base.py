@@ -18,29 +18,78 @@ from nacelle.handlers.mixins import TemplateMixins
 
 class BaseHandler(webapp2.RequestHandler):
 
-    def dispatch(self):
+    """
+    Base handler providing lazily loaded sessions.  The session cookie is
+    only decoded when self.session is first accessed and only written
+    back if the session was modified, so requests which don't touch the
+    session don't pay for it (or send a Set-Cookie header).
+    """
 
-        # Get a session store for this request.
-        self.session_store = sessions.get_store(request=self.request)
+    # set to False for stateless handlers which never use a session
+    use_sessions = True
+    # session factory to use, e.g. nacelle.sessions.ServerSessionFactory
+    # to keep session data server side (defaults to a secure cookie)
+    session_factory = None
+    # set to True for handlers which render forms to ensure a CSRF token
+    # is available (self.csrf_token also mints one on first access)
+    csrf = False
+
+    def dispatch(self):
 
         # Set a CSRF token for this request if there is None
-        csrf_token = self.session.get('csrf_token', None)
-        if csrf_token is None:
-            self.session['csrf_token'] = str(uuid.uuid4())
+        if self.csrf:
+            self.csrf_token
 
         try:
             # Dispatch the request.
             webapp2.RequestHandler.dispatch(self)
         finally:
-            # Save all sessions.
-            self.session_store.save_sessions(self.response)
+            # Save any sessions used during this request, unmodified
+            # sessions are skipped by the session store
+            if 'session_store' in self.__dict__:
+                self.session_store.save_sessions(self.response)
+
+    @webapp2.cached_property
+    def session_store(self):
+
+        # Get a session store for this request.
+        if not self.use_sessions:
+            raise AttributeError('Sessions are disabled for %s' % self.__class__.__name__)
+        return sessions.get_store(request=self.request)
 
     @webapp2.cached_property
     def session(self):
 
         # Returns a session using the default cookie key.
+        if self.session_factory is not None:
+            return self.session_store.get_session(factory=self.session_factory)
         return self.session_store.get_session()
 
+    @property
+    def has_session(self):
+
+        """
+        Check whether the client sent a session cookie, without
+        decoding it
+        """
+
+        if not self.use_sessions:
+            return False
+        return self.session_store.config['cookie_name'] in self.request.cookies
+
+    @property
+    def csrf_token(self):
+
+        """
+        Return the CSRF token stored in the session, minting a new
+        one if there is none
+        """
+
+        csrf_token = self.session.get('csrf_token', None)
+        if csrf_token is None:
+            csrf_token = self.session['csrf_token'] = str(uuid.uuid4())
+        return csrf_token
+
 
 class TemplateHandler(TemplateMixins, BaseHandler):
 
@@ -53,13 +102,19 @@ class TemplateHandler(TemplateMixins, BaseHandler):
     template = None
 
     def get_messages(self):
+        # avoid loading a session just to find it has no messages
+        if 'session' not in self.__dict__ and not self.has_session:
+            return None
         try:
             return self.session.pop('messages')
         except KeyError:
             return None
 
     def add_message(self, message):
-        self.session['messages'].append(message)
+        # reassign the list so that the session is marked as modified
+        messages = self.session.get('messages', [])
+        messages.append(message)
+        self.session['messages'] = messages
 
     @property
     def default_context(self):
@@ -78,7 +133,13 @@ class TemplateHandler(TemplateMixins, BaseHandler):
         context['request'] = self.request
         # add any messages to the context
         context['messages'] = self.get_messages()
-        context['session'] = self.session
+        # only decode the session cookie if the client sent one (or the
+        # session has already been loaded during this request)
+        if 'session' in self.__dict__ or self.has_session:
+            context['session'] = self.session
+        # add a CSRF token for handlers which render forms
+        if self.csrf:
+            context['csrf_token'] = self.csrf_token
 
         # return the default context
         return context
@@ -113,7 +174,8 @@ class TemplateHandler(TemplateMixins, BaseHandler):
 class JSONHandler(JSONMixins, BaseHandler):
 
     """
-    Simple handler to build and return a JSON object
+    Simple handler to build and return a JSON object.  Set use_sessions
+    to False for a stateless handler which has no session at all.
     """
 
     def get_context(self):
@@ -17,6 +17,55 @@ from nacelle import error
 from nacelle import sentry
 
 
+# registry key under which our shared jinja instance is stored
+JINJA2_REGISTRY_KEY = 'webapp2_extras.jinja2.Jinja2'
+
+# process-wide index of template directories, built on first use (or
+# at warmup) so that we only walk the project tree once per instance
+_template_dirs = None
+
+
+def get_template_dirs():
+
+    """
+    Find all directories within the project called 'templates'. The tree
+    is only walked once per process, subsequent calls return the cached list
+    """
+
+    global _template_dirs
+    if _template_dirs is None:
+        template_dirs = []
+        # loop over all directories in project
+        for root, dirs, files in os.walk(settings.PROJECT_ROOT):
+            # check if any template directories present
+            for dirname in dirs:
+                if dirname == 'templates':
+                    template_dirs.append(os.path.join(root, dirname))
+        _template_dirs = template_dirs
+    return _template_dirs
+
+
+def get_compiled_templates_path():
+
+    """
+    Return the absolute path of the precompiled template bundle if one has
+    been configured and should be used, otherwise None
+    """
+
+    compiled_path = getattr(settings, 'TEMPLATE_COMPILED_PATH', None)
+    if not compiled_path:
+        return None
+    # templates are always parsed from source in DEBUG mode unless
+    # the use of the compiled bundle is forced in settings
+    if settings.DEBUG and not getattr(settings, 'TEMPLATE_FORCE_COMPILED', False):
+        return None
+    compiled_path = os.path.join(settings.PROJECT_ROOT, compiled_path)
+    if not os.path.exists(compiled_path):
+        logging.warning('Compiled templates not found, loading from source: %s' % compiled_path)
+        return None
+    return compiled_path
+
+
 class TemplateMixins(object):
 
     """
@@ -27,17 +76,13 @@ class TemplateMixins(object):
     def get_template_dirs(self):
 
         """
-        Find all directories within the project called 'templates' and build
-        a Jinja2 FileSystemLoader for each one
+        Build a Jinja2 FileSystemLoader for each of the project's
+        template directories
         """
 
-        # loop over all directories in project
-        for root, dirs, files in os.walk(settings.PROJECT_ROOT):
-            # check if any template directories present
-            for dirname in dirs:
-                if dirname == 'templates':
-                    # build and yield a FileSystemLoader for each template directory
-                    yield jinja2.jinja2.FileSystemLoader(os.path.join(root, dirname))
+        for template_dir in get_template_dirs():
+            # build and yield a FileSystemLoader for each template directory
+            yield jinja2.jinja2.FileSystemLoader(template_dir)
 
     def get_jinja2(self, factory=jinja2.Jinja2, app=None, config=None):
 
@@ -45,27 +90,38 @@ class TemplateMixins(object):
         Build and return a configured Jinja" instance cached in the app registry
         """
 
-        # registry key
-        key = 'webapp2_extras.jinja2.Jinja2'
         # get current WSGI app
         app = app or webapp2.get_app()
         # attempt to get jinja instance from app registry
-        jinja2 = app.registry.get(key)
+        jinja2 = app.registry.get(JINJA2_REGISTRY_KEY)
         if not jinja2:
             # build and cache jinja instance
-            jinja2 = app.registry[key] = factory(app, config)
+            jinja2 = app.registry[JINJA2_REGISTRY_KEY] = factory(app, config)
         # return jinja instance
         return jinja2
 
-    @webapp2.cached_property
-    def jinja2(self):
+    def get_template_loader(self):
 
         """
-        Configure and return an initialised jinja instance
+        Build and return the loader used by our jinja instance.  Templates
+        are loaded only from the precompiled bundle when one is in use,
+        otherwise from each of the project's template directories
         """
 
+        compiled_path = get_compiled_templates_path()
+        if compiled_path is not None:
+            return jinja2.jinja2.ModuleLoader(compiled_path)
         # build a choiceloader from our found template directories
-        template_loader = jinja2.jinja2.ChoiceLoader(list(self.get_template_dirs()))
+        return jinja2.jinja2.ChoiceLoader(list(self.get_template_dirs()))
+
+    def get_jinja2_config(self, template_loader=None):
+
+        """
+        Build and return the config used to initialise our jinja instance
+        """
+
+        if template_loader is None:
+            template_loader = self.get_template_loader()
         # define our default template extensions
         template_extensions = [
             'jinja2.ext.autoescape',
@@ -82,8 +138,8 @@ class TemplateMixins(object):
         else:
             filters = None
 
-        # build our jinja config
-        config = {
+        # build and return our jinja config
+        return {
             'template_path': 'templates',
             'compiled_path': None,
             'force_compiled': False,
@@ -95,8 +151,21 @@ class TemplateMixins(object):
             'globals': None,
             'filters': filters,
         }
+
+    @webapp2.cached_property
+    def jinja2(self):
+
+        """
+        Configure and return an initialised jinja instance
+        """
+
+        # the jinja instance is shared by every handler in this process so
+        # only build its config (and loaders) if it hasn't been created yet
+        jinja2 = self.app.registry.get(JINJA2_REGISTRY_KEY)
+        if jinja2:
+            return jinja2
         # Returns a Jinja2 renderer cached in the app registry.
-        return self.get_jinja2(app=self.app, config=config)
+        return self.get_jinja2(app=self.app, config=self.get_jinja2_config())
 
     def template_response(self, _template, **context):
 
@@ -213,4 +282,4 @@ class JSONMixins(object):
                 self.json_response({'error': 'A server error has occurred'})
             # otherwise return the error message's value
             else:
-                self.json_response({'error': exc_info[1]})
+                self.json_response({'error': str(exc_info[1])})
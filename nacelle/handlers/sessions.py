@@ -0,0 +1,23 @@
+"""
+Handlers for maintaining nacelle's server side sessions
+"""
+# third-party imports
+import webapp2
+from google.appengine.ext import deferred
+
+# local imports
+from nacelle.handlers.mixins import JSONMixins
+from nacelle.sessions import sweep_expired_sessions
+
+
+class SessionSweepHandler(JSONMixins, webapp2.RequestHandler):
+
+    """
+    Cron handler which queues a sweep of expired sessions
+    """
+
+    def get(self):
+
+        # run the sweep on a task queue
+        deferred.defer(sweep_expired_sessions)
+        return self.json_response({'status': "Task queued"})
@@ -2,10 +2,24 @@
 Auth related models for nacelle
 """
 # third-party imports
+from google.appengine.api import memcache
 from google.appengine.ext import db
 
 # local imports
 from nacelle.models.validators import validate_email
+from nacelle.utils.cache import get_or_compute
+from nacelle.utils.lrucache import LRUCache
+
+# memcache key for the set of AdminUser emails
+ADMIN_EMAILS_KEY = 'admin-emails'
+# number of seconds the set of emails is cached in memcache for
+ADMIN_MEMCACHE_TIME = 3600
+# number of seconds the set of emails is cached in instance memory for,
+# this bounds how long other instances take to notice a change
+ADMIN_LOCAL_CACHE_TIME = 60
+
+# per-instance cache of the set of AdminUser emails
+_admin_cache = LRUCache(max_size=1, ttl=ADMIN_LOCAL_CACHE_TIME)
 
 
 class AdminUser(db.Model):
@@ -15,8 +29,53 @@ class AdminUser(db.Model):
     be allowed to access any admin only areas of the site.
 
     These users must be logged in via appengine's users
-    service
+    service.  Changes made with put() and delete() invalidate
+    the cached set of admin emails, call invalidate_admin_emails()
+    after writing AdminUsers any other way (e.g. db.put).
     """
 
     # email address
     email = db.EmailProperty(validator=validate_email)
+
+    def put(self, **kwargs):
+        key = super(AdminUser, self).put(**kwargs)
+        invalidate_admin_emails()
+        return key
+
+    def delete(self, **kwargs):
+        super(AdminUser, self).delete(**kwargs)
+        invalidate_admin_emails()
+
+
+def get_admin_emails():
+
+    """
+    Return a frozenset of all AdminUser emails, cached in instance
+    memory and memcache to avoid querying them on every request
+    """
+
+    emails = _admin_cache.get(ADMIN_EMAILS_KEY)
+    if emails is None:
+        compute = lambda: frozenset(u.email for u in AdminUser.all())
+        emails = get_or_compute(ADMIN_EMAILS_KEY, compute, ADMIN_MEMCACHE_TIME)
+        _admin_cache.set(ADMIN_EMAILS_KEY, emails)
+    return emails
+
+
+def is_admin_email(email):
+
+    """
+    Check whether email belongs to a registered AdminUser
+    """
+
+    return email in get_admin_emails()
+
+
+def invalidate_admin_emails():
+
+    """
+    Clear the cached set of AdminUser emails
+    """
+
+    _admin_cache.clear()
+    memcache.delete(ADMIN_EMAILS_KEY)
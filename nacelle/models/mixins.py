@@ -5,10 +5,8 @@ of model instances
 # stdlib imports
 import json
 
-# third-party imports
-from google.appengine.ext import db
-
 # local imports
+from nacelle.utils.serialize import compile_serializer
 from nacelle.utils.serialize import property_to_json
 from nacelle.utils.serialize import json_to_property
 
@@ -20,15 +18,37 @@ class JSONMixins(object):
     serialisation/deserialisation of your model instances.
     """
 
+    @classmethod
+    def get_json_serializer(cls):
+
+        """Return the compiled serializer for this model class, building it on first use"""
+
+        # check the class's own dict so subclasses don't inherit
+        # a serializer compiled for their parent
+        serializer = cls.__dict__.get('_json_serializer')
+        if serializer is None:
+            serializer = compile_serializer(cls)
+            cls._json_serializer = serializer
+        return serializer
+
     def get_json(self, encode=True):
 
         """Build and return a JSON representation of our model"""
 
-        # convert entity to dict
-        instance_dict = db.to_dict(self)
-        # loop over and serialise dict values
-        for key, val in instance_dict.items():
-            instance_dict[key] = property_to_json(val)
+        instance_dict = {}
+        # serialise declared properties using the converters compiled
+        # for this model class
+        for name, prop, converter in self.get_json_serializer():
+            val = prop.get_value_for_datastore(self)
+            # empty lists aren't stored (matches db.to_dict)
+            if isinstance(val, list) and not val:
+                continue
+            if converter is not None:
+                val = converter(val)
+            instance_dict[name] = val
+        # serialise any dynamic (Expando) properties
+        for name in self.dynamic_properties():
+            instance_dict[name] = property_to_json(getattr(self, name))
         # serialise entity's key
         instance_dict['key'] = str(self.key())
 
@@ -48,12 +68,14 @@ class JSONMixins(object):
         else:
             json_dict = value
 
+        # declared properties let us convert values without guessing
+        properties = self.properties()
         # loop over all vals in JSON object
         for key, val in json_dict.items():
             # skip 'key' field if specified
             if key == 'key':
                 continue
-            processed_val = json_to_property(val)
+            processed_val = json_to_property(val, properties.get(key))
             # set value as model property
             setattr(self, key, processed_val)
 
@@ -0,0 +1,18 @@
+"""
+Session related models for nacelle
+"""
+# third-party imports
+from google.appengine.ext import db
+
+
+class Session(db.Model):
+
+    """
+    Durable copy of a server side session's data, keyed by
+    session id (see nacelle.sessions)
+    """
+
+    # pickled session dict
+    data = db.BlobProperty()
+    # time after which the session may be swept
+    expires = db.DateTimeProperty()
@@ -4,6 +4,10 @@ import re
 # third-party imports
 from google.appengine.api import mail
 
+# local imports
+from nacelle.utils import uniqify
+from nacelle.utils.lrucache import LRUCache
+
 # shamelessly stolen from django.core.validators
 # this works but SublimeLinter seems to think there's
 # a string encapsulation issue (which there isn't)
@@ -16,19 +20,63 @@ email_re = re.compile(
     r'|\[(25[0-5]|2[0-4]\d|[0-1]?\d?\d)(\.(25[0-5]|2[0-4]\d|[0-1]?\d?\d)){3}\]$', re.IGNORECASE)  # literal form, ipv4 address (SMTP 4.1.3)
 
 
+# maximum number of recently validated addresses to remember
+EMAIL_CACHE_SIZE = 10000
+
+# recently validated addresses mapped to True (valid) or to the
+# exception which should be raised for them (invalid)
+_validated_emails = LRUCache(max_size=EMAIL_CACHE_SIZE)
+
+
 class ValidationError(Exception):
     pass
 
 
+def _check_email(value):
+
+    """
+    Run the full set of checks on an email address returning True if it
+    is valid or the exception to raise if it isn't
+    """
+
+    # validate against the Django email_re above
+    if not email_re.search(value):
+        return ValidationError('email invalid: %s' % value)
+    # use appengine's own mail validation just to be sure (yes
+    # it's almost useless but worth a check... just to be sure)
+    try:
+        mail.check_email_valid(value, 'email')
+    except mail.InvalidEmailError, e:
+        return e
+    return True
+
+
 def validate_email(value):
 
     # check that we've actually been passed a value here
-    if value is not None:
-        # validate against the Django email_re above
-        if not email_re.search(value):
-            raise ValidationError('email invalid: %s' % value)
-        # use appengine's own mail validation just to be sure (yes
-        # it's almost useless but worth a check... just to be sure)
-        mail.check_email_valid(value, 'email')
-    else:
+    if value is None:
         raise ValidationError('email required')
+    # only run the checks for addresses we haven't seen recently
+    result = _validated_emails.get(value)
+    if result is None:
+        result = _check_email(value)
+        _validated_emails.set(value, result)
+    if result is not True:
+        raise result
+
+
+def validate_emails(values):
+
+    """
+    Validate many email addresses at once, checking each distinct address
+    only once.  Returns a dict mapping any invalid addresses to the
+    exception validate_email would raise for them.
+    """
+
+    errors = {}
+    for value in uniqify(values):
+        try:
+            validate_email(value)
+        except (ValidationError, mail.InvalidEmailError), e:
+            errors[value] = e
+    return errors
@@ -1,11 +1,50 @@
 """
 Useful sentry related functions for use in a nacelle project
+
+Errors are reported asynchronously: events are built during the request
+but queued in memcache and sent to sentry in batches by a deferred task,
+so users don't wait on the encode and POST.  Identical errors (same
+culprit and message) are only reported once per SENTRY_DEDUPE_WINDOW
+and no more than SENTRY_RATE_LIMIT events are queued per minute, so an
+incident which raises the same exception hundreds of times a second
+doesn't flood sentry or the task queue.
 """
+# stdlib imports
+import hashlib
+import logging
+import time
+import traceback
+
 # third-party imports
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import deferred
 from raven import Client
 
 # local imports
 import settings
+from nacelle.utils.lrucache import LRUCache
+
+# send events from a deferred task rather than during the request
+SENTRY_ASYNC = getattr(settings, 'SENTRY_ASYNC', True)
+# number of seconds during which identical events are only reported once
+SENTRY_DEDUPE_WINDOW = getattr(settings, 'SENTRY_DEDUPE_WINDOW', 60)
+# maximum number of events queued per minute (None for no limit)
+SENTRY_RATE_LIMIT = getattr(settings, 'SENTRY_RATE_LIMIT', 60)
+# number of seconds between flushes of queued events
+SENTRY_FLUSH_INTERVAL = getattr(settings, 'SENTRY_FLUSH_INTERVAL', 10)
+# number of seconds queued events are kept in memcache for
+EVENT_CACHE_TIME = 3600
+
+# memcache keys
+QUEUE_HEAD_KEY = 'sentry-queue-head'
+QUEUE_TAIL_KEY = 'sentry-queue-tail'
+QUEUE_GAP_KEY = 'sentry-queue-gap'
+EVENT_KEY_PREFIX = 'sentry-event:'
+
+# per-instance record of recently reported events, saves a memcache
+# round trip for the most frequent duplicates
+_recent_events = LRUCache(max_size=1000, ttl=SENTRY_DEDUPE_WINDOW)
 
 
 # check if sentry enabled
@@ -13,6 +52,153 @@ if settings.ENABLE_SENTRY:
     sentry = Client(settings.SENTRY_DSN)
 
 
+def get_event_signature(exc_info):
+
+    """
+    Build a cheap signature identifying an exception by its culprit
+    (the innermost frame of the traceback) and message
+    """
+
+    exc_type, exc_value, tb = exc_info
+    culprit = ''
+    frames = traceback.extract_tb(tb)
+    if frames:
+        filename, lineno, function, line = frames[-1]
+        culprit = '%s:%s:%s' % (filename, lineno, function)
+    try:
+        message = str(exc_value)
+    except Exception:
+        message = repr(exc_value)
+    signature = '%s|%s|%s' % (getattr(exc_type, '__name__', exc_type), culprit, message)
+    return hashlib.md5(signature).hexdigest()
+
+
+def _dedupe_key(signature):
+    return 'sentry-dedupe:%s' % signature
+
+
+def is_duplicate(signature):
+
+    """
+    Check whether an event with this signature has already been
+    reported within the dedupe window, recording it as reported if not
+    """
+
+    if _recent_events.get(signature):
+        return True
+    _recent_events.set(signature, True)
+    # memcache.add fails if another instance reported it first
+    return not memcache.add(_dedupe_key(signature), True, time=SENTRY_DEDUPE_WINDOW)
+
+
+def forget_event(signature):
+
+    """
+    Remove the record of an event which was recorded as reported but
+    then dropped, so that the next occurrence is reported
+    """
+
+    _recent_events.delete(signature)
+    memcache.delete(_dedupe_key(signature))
+
+
+def is_rate_limited():
+
+    """
+    Count an event against the per-minute rate limit and check
+    whether the limit has been exceeded
+    """
+
+    if SENTRY_RATE_LIMIT is None:
+        return False
+    key = 'sentry-rate:%d' % int(time.time() / 60)
+    count = memcache.incr(key, initial_value=0)
+    return count is not None and count > SENTRY_RATE_LIMIT
+
+
+def queue_event(data):
+
+    """
+    Add an event to the queue in memcache and make sure a flush task
+    is scheduled to send it
+    """
+
+    index = memcache.incr(QUEUE_TAIL_KEY, initial_value=0)
+    if index is None or not memcache.set(EVENT_KEY_PREFIX + str(index), data, time=EVENT_CACHE_TIME):
+        # memcache is unavailable so send the event on its own
+        deferred.defer(send_events, [data])
+        return
+
+    # one flush task per interval sends everything queued so far
+    schedule_flush(int(time.time() / SENTRY_FLUSH_INTERVAL))
+
+
+def schedule_flush(window):
+
+    """
+    Make sure a flush task is scheduled for the given interval
+    """
+
+    try:
+        deferred.defer(flush_events, _name='sentry-flush-%d' % window, _countdown=SENTRY_FLUSH_INTERVAL)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def send_events(events):
+
+    """
+    Send a batch of built events to the sentry server
+    """
+
+    for data in events:
+        try:
+            sentry.send(**data)
+        except Exception:
+            logging.exception('Unable to send event to sentry')
+
+
+def flush_events():
+
+    """
+    Send all events queued in memcache since the last flush, in order.
+    queue_event claims an index before storing its event, so a missing
+    event may just not have been stored yet.  The flush stops at the
+    first missing event and leaves it, and everything after it, to a
+    later flush.  An event which is still missing at that later flush
+    was never stored (e.g. memcache failed) and is skipped.
+    """
+
+    tail = memcache.get(QUEUE_TAIL_KEY)
+    if tail is None:
+        return
+    head = memcache.get(QUEUE_HEAD_KEY) or 0
+    if head >= tail:
+        return
+    indexes = range(head + 1, tail + 1)
+    events = memcache.get_multi([str(i) for i in indexes], key_prefix=EVENT_KEY_PREFIX)
+
+    keys = []
+    for index in indexes:
+        key = str(index)
+        if key not in events:
+            if memcache.get(QUEUE_GAP_KEY) != index:
+                # give the event a chance to be stored and try again
+                memcache.set(QUEUE_GAP_KEY, index, time=EVENT_CACHE_TIME)
+                schedule_flush(int(time.time() / SENTRY_FLUSH_INTERVAL) + 1)
+                break
+            logging.warning('Sentry event %d was never stored, skipping it' % index)
+        else:
+            keys.append(key)
+        head = index
+
+    # mark the events as sent before sending so a slow flush
+    # doesn't cause the next one to send them again
+    memcache.set(QUEUE_HEAD_KEY, head)
+    memcache.delete_multi(keys, key_prefix=EVENT_KEY_PREFIX)
+    send_events([events[k] for k in keys])
+
+
 def capture_exception(request, exc_info):
 
     """
@@ -23,6 +209,16 @@ def capture_exception(request, exc_info):
     if not settings.ENABLE_SENTRY:
         return None
 
+    # drop duplicate events and events beyond the rate limit
+    signature = get_event_signature(exc_info)
+    if is_duplicate(signature):
+        return None
+    if is_rate_limited():
+        # the event was never reported so don't suppress it as a duplicate
+        forget_event(signature)
+        logging.warning('Sentry rate limit exceeded, event not reported')
+        return None
+
     # build our error report
     error_report = {
             'method': request.method,
@@ -38,7 +234,17 @@ def capture_exception(request, exc_info):
         }
 
     # Log the error to sentry
-    sentry.capture('Exception',
+    if not SENTRY_ASYNC:
+        return sentry.capture('Exception',
+            exc_info=exc_info,
+            data={'sentry.interfaces.Http': error_report},
+        )
+
+    # the traceback can't be pickled so build the event now and leave
+    # encoding and sending it to a task
+    data = sentry.build_msg('Exception',
         exc_info=exc_info,
         data={'sentry.interfaces.Http': error_report},
     )
+    queue_event(data)
+    return (data['event_id'], data['checksum'])
@@ -0,0 +1,166 @@
+"""
+Nacelle microframework
+Copyright (C) Patrick Carey 2012
+
+Server side sessions.  The session cookie carries only a (signed)
+session id while the session data lives in memcache, with writes
+persisted to the datastore shortly afterwards (write-behind) so that
+sessions survive memcache evictions.
+
+To use server side sessions set session_factory on your handlers:
+
+    from nacelle.sessions import ServerSessionFactory
+
+    class MyHandler(TemplateHandler):
+        session_factory = ServerSessionFactory
+
+Expired sessions are removed from the datastore by sweep_expired_sessions,
+which is run daily by the cron job in apps/default_app/cron.yaml (via
+nacelle.handlers.sessions.SessionSweepHandler).
+"""
+# stdlib imports
+import cPickle as pickle
+import datetime
+import time
+
+# third-party imports
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+from webapp2_extras import sessions
+
+# local imports
+from nacelle.models.sessions import Session
+
+# number of seconds a session lives for after it was last modified
+SESSION_TIMEOUT = 86400 * 14
+# maximum number of seconds between a session being modified in
+# memcache and being written to the datastore
+WRITE_BEHIND_DELAY = 10
+# number of expired sessions deleted by each sweep task
+SWEEP_BATCH_SIZE = 500
+# prefix for session data stored in memcache
+KEY_PREFIX = 'session:'
+
+
+def load_sessions(sids):
+
+    """
+    Return a dict of session id to session data for any of the given
+    session ids which exist.  Memcache is read in a single batch and any
+    misses are then read from the datastore in a single batch and put
+    back in memcache.
+    """
+
+    data = memcache.get_multi(sids, key_prefix=KEY_PREFIX)
+    missing = [sid for sid in sids if sid not in data]
+    if not missing:
+        return data
+
+    found = {}
+    now = datetime.datetime.now()
+    for sid, session in zip(missing, Session.get_by_key_name(missing)):
+        if session is not None and session.expires > now:
+            found[sid] = pickle.loads(session.data)
+    if found:
+        memcache.set_multi(found, time=SESSION_TIMEOUT, key_prefix=KEY_PREFIX)
+        data.update(found)
+    return data
+
+
+def persist_sessions(sids, data=None):
+
+    """
+    Write the given sessions' data (read from memcache if data
+    isn't passed) to the datastore
+    """
+
+    if data is None:
+        data = memcache.get_multi(sids, key_prefix=KEY_PREFIX)
+    expires = datetime.datetime.now() + datetime.timedelta(seconds=SESSION_TIMEOUT)
+    entities = []
+    for sid, session_data in data.items():
+        entities.append(Session(
+            key_name=sid,
+            data=db.Blob(pickle.dumps(session_data, pickle.HIGHEST_PROTOCOL)),
+            expires=expires,
+        ))
+    db.put(entities)
+
+
+def save_session_data(sid, data):
+
+    """
+    Store a session's data in memcache and schedule it to be written to
+    the datastore.  Writes made within the same WRITE_BEHIND_DELAY
+    window share a single (named) task which persists the latest data.
+    """
+
+    # fall back to writing straight to the datastore if memcache fails
+    if not memcache.set(KEY_PREFIX + sid, data, time=SESSION_TIMEOUT):
+        persist_sessions([sid], {sid: data})
+        return
+
+    window = int(time.time() / WRITE_BEHIND_DELAY)
+    try:
+        deferred.defer(
+            persist_sessions,
+            [sid],
+            _name='session-%s-%s' % (sid, window),
+            _countdown=WRITE_BEHIND_DELAY,
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        # a write for this window is already scheduled
+        pass
+
+
+def sweep_expired_sessions():
+
+    """
+    Delete a batch of expired sessions from the datastore, chaining
+    another sweep if there may be more.  Returns the number deleted.
+    """
+
+    query = Session.all(keys_only=True).filter('expires <', datetime.datetime.now())
+    keys = query.fetch(SWEEP_BATCH_SIZE)
+    db.delete(keys)
+    if len(keys) == SWEEP_BATCH_SIZE:
+        deferred.defer(sweep_expired_sessions)
+    return len(keys)
+
+
+class ServerSessionFactory(sessions.CustomBackendSessionFactory):
+
+    """
+    Session factory which keeps only the session id in the cookie and
+    stores session data server side (see module docstring)
+    """
+
+    def _get_by_sid(self, sid):
+
+        """
+        Returns a session given a session id
+        """
+
+        if self._is_valid_sid(sid):
+            data = load_sessions([sid]).get(sid)
+            if data is not None:
+                self.sid = sid
+                return sessions.SessionDict(self, data=data)
+
+        self.sid = self._get_new_sid()
+        return sessions.SessionDict(self, new=True)
+
+    def save_session(self, response):
+
+        """
+        Save the session's data if it has been modified and set the
+        session id cookie
+        """
+
+        if self.session is None or not self.session.modified:
+            return
+
+        save_session_data(self.sid, dict(self.session))
+        self.session_store.save_secure_cookie(response, self.name, {'_sid': self.sid}, **self.session_args)
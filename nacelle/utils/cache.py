@@ -0,0 +1,222 @@
+"""
+Memcache helpers which protect expensive computations against cache
+stampedes (dogpiling).
+
+Values are stored along with the time at which they should be refreshed
+and are kept in memcache for a while after that (the stale period).  When
+a value needs refreshing a single request takes a short lease on the key
+(via memcache.add) and recomputes it while any other requests keep serving
+the stale value.  If there is no value at all, requests which don't hold
+the lease wait briefly for the holder to store one before giving up and
+computing it themselves.
+"""
+# stdlib imports
+import logging
+import threading
+import time
+import uuid
+
+# third-party imports
+from google.appengine.api import memcache
+
+# maximum number of seconds a lease is held for (should comfortably
+# exceed the time taken to compute any cached value)
+LEASE_TIMEOUT = 10
+# maximum number of seconds to wait for another request to fill the cache
+LEASE_WAIT = 0.5
+# number of seconds between checks while waiting
+LEASE_POLL_INTERVAL = 0.05
+# number of seconds hit/miss counts are buffered in instance memory
+# before being added to the shared counters in memcache
+STATS_FLUSH_INTERVAL = 10
+
+# hit/miss counts which haven't been flushed to memcache yet
+_pending_stats = {}
+_pending_stats_lock = threading.Lock()
+_stats_flushed_at = time.time()
+
+
+class CacheEntry(object):
+
+    """
+    Wraps a cached value along with the time after which it should be
+    refreshed (None to never refresh)
+    """
+
+    def __init__(self, value, refresh_at=None):
+        self.value = value
+        self.refresh_at = refresh_at
+
+    def is_stale(self):
+        return self.refresh_at is not None and self.refresh_at <= time.time()
+
+
+def _lease_key(key):
+    return 'lease:' + key
+
+
+def set_value(key, value, ttl, stale_ttl=None, client=memcache, wait=True):
+
+    """
+    Store value in memcache so that it is considered fresh for ttl seconds
+    (0 == forever) and may be served stale for a further stale_ttl seconds
+    (defaults to ttl) while it is refreshed.  If wait is False the write
+    is made asynchronously (client must be a memcache.Client instance).
+    """
+
+    if not ttl:
+        entry = CacheEntry(value)
+        expires = 0
+    else:
+        if stale_ttl is None:
+            stale_ttl = ttl
+        entry = CacheEntry(value, time.time() + ttl)
+        expires = ttl + stale_ttl
+    if not wait:
+        # the rpc completes in the background
+        return client.set_multi_async({key: entry}, time=expires)
+    return client.set(key, entry, time=expires)
+
+
+def _is_usable(entry, is_valid):
+    if not isinstance(entry, CacheEntry):
+        return False
+    return is_valid is None or is_valid(entry.value)
+
+
+def resolve(key, entry, compute, ttl, stale_ttl=None, client=memcache, wait=True, is_valid=None):
+
+    """
+    Return the value for key given whatever was fetched from memcache for
+    it, calling compute() to (re)build it when it is missing or stale.
+    Only one request at a time recomputes a given key, see the module
+    docstring for details.  If wait is False cache writes are made
+    asynchronously (client must be a memcache.Client instance).  If
+    is_valid is given, cached values for which is_valid(value) is False
+    (e.g. values built before an invalidation) are treated as missing,
+    including any found while waiting for another request's value.
+    """
+
+    # treat anything we didn't store ourselves (or that is no longer
+    # valid) as a miss
+    if not _is_usable(entry, is_valid):
+        entry = None
+    if entry is not None and not entry.is_stale():
+        return entry.value
+
+    lease_key = _lease_key(key)
+    if not client.add(lease_key, True, time=LEASE_TIMEOUT):
+        # someone else is already recomputing this value
+        if entry is not None:
+            # serve the stale value while it's refreshed
+            return entry.value
+        # wait briefly for the value to appear
+        waited = 0
+        while waited < LEASE_WAIT:
+            time.sleep(LEASE_POLL_INTERVAL)
+            waited += LEASE_POLL_INTERVAL
+            entry = client.get(key)
+            if _is_usable(entry, is_valid):
+                return entry.value
+        logging.info('Timed out waiting for lease on: %s' % key)
+        return compute()
+
+    # we hold the lease so recompute and store the value
+    try:
+        value = compute()
+        set_value(key, value, ttl, stale_ttl=stale_ttl, client=client, wait=wait)
+    finally:
+        if wait:
+            client.delete(lease_key)
+        else:
+            client.delete_multi_async([lease_key])
+    return value
+
+
+def get_or_compute(key, compute, ttl, stale_ttl=None, client=memcache, is_valid=None):
+
+    """
+    Return the cached value for key, calling compute() to (re)build it when
+    it is missing, stale or invalid (see resolve)
+    """
+
+    return resolve(key, client.get(key), compute, ttl, stale_ttl=stale_ttl, client=client, is_valid=is_valid)
+
+
+def get_generation_key(namespace):
+    return 'generation:' + namespace
+
+
+def get_generation(namespace, client=memcache):
+
+    """
+    Return the current cache generation for namespace.  Folding this into
+    cache keys allows every value in the namespace to be invalidated at
+    once by bumping the generation.
+    """
+
+    key = get_generation_key(namespace)
+    generation = client.get(key)
+    if generation is None:
+        # generations are random so that one which has been evicted from
+        # memcache can never be reused and bring back old cached values
+        generation = uuid.uuid4().hex
+        if not client.add(key, generation):
+            generation = client.get(key) or generation
+    return generation
+
+
+def bump_generation(namespace, client=memcache):
+
+    """
+    Invalidate every cached value in namespace by moving it on to a
+    new generation
+    """
+
+    generation = uuid.uuid4().hex
+    client.set(get_generation_key(namespace), generation)
+    return generation
+
+
+def _stats_key(namespace, stat):
+    return 'cache-stats:%s:%s' % (namespace, stat)
+
+
+def record_cache_stat(namespace, hit, client=memcache, wait=True):
+
+    """
+    Count a cache hit (or miss if hit is False) for namespace.  Counts are
+    buffered in instance memory and periodically added to counters in
+    memcache so that recording a stat rarely costs an RPC.  If wait is
+    False the flush is made asynchronously (client must be a
+    memcache.Client instance).
+    """
+
+    global _pending_stats, _stats_flushed_at
+    key = _stats_key(namespace, 'hits' if hit else 'misses')
+    with _pending_stats_lock:
+        _pending_stats[key] = _pending_stats.get(key, 0) + 1
+        if time.time() - _stats_flushed_at < STATS_FLUSH_INTERVAL:
+            return
+        pending, _pending_stats = _pending_stats, {}
+        _stats_flushed_at = time.time()
+    if not wait:
+        return client.offset_multi_async(pending, initial_value=0)
+    client.offset_multi(pending, initial_value=0)
+
+
+def get_cache_stats(namespace, client=memcache):
+
+    """
+    Return a dict of hit and miss counts for namespace across all
+    instances (including this instance's unflushed counts)
+    """
+
+    stats = {}
+    keys = dict((stat, _stats_key(namespace, stat)) for stat in ('hits', 'misses'))
+    counts = client.get_multi(keys.values())
+    for stat, key in keys.items():
+        stats[stat] = int(counts.get(key) or 0) + _pending_stats.get(key, 0)
+    total = stats['hits'] + stats['misses']
+    stats['ratio'] = float(stats['hits']) / total if total else None
+    return stats
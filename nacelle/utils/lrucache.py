@@ -0,0 +1,86 @@
+"""
+A simple thread-safe, size bounded, in-process LRU cache with optional
+expiry of entries.  Useful for keeping small, rarely changing values
+in instance memory to avoid repeated memcache/datastore round trips.
+"""
+# stdlib imports
+import threading
+import time
+from collections import OrderedDict
+
+# sentinel used to distinguish missing entries from cached None values
+_missing = object()
+
+
+class LRUCache(object):
+
+    """
+    Size bounded least recently used cache.
+
+    max_size (int): maximum number of entries to hold
+    ttl (int/float): number of seconds after which entries expire,
+                     None to keep entries until they are evicted
+    """
+
+    def __init__(self, max_size=1000, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def get(self, key, default=None):
+
+        """
+        Return the value stored for key, or default if the key
+        is missing or has expired
+        """
+
+        with self._lock:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires < time.time():
+                return default
+            # reinsert to mark the entry as most recently used
+            self._data[key] = (value, expires)
+            return value
+
+    def set(self, key, value, ttl=None):
+
+        """
+        Store value for key, evicting the least recently used entry
+        if the cache is full.  ttl overrides the cache's default ttl.
+        """
+
+        ttl = ttl if ttl is not None else self.ttl
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+
+        """
+        Remove key from the cache if present
+        """
+
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+
+        """
+        Remove all entries from the cache
+        """
+
+        with self._lock:
+            self._data.clear()
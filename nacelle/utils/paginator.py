@@ -8,6 +8,16 @@ License: https://github.com/django/django/blob/master/LICENSE
 # stdlib imports
 from math import ceil
 
+# appengine SDK imports
+from google.appengine.api import memcache
+
+# number of seconds page cursors are cached for
+CURSOR_CACHE_TIME = 600
+# number of seconds approximate counts are cached for
+COUNT_CACHE_TIME = 300
+# maximum number of entities counted when estimating the number of pages
+MAX_COUNT = 1000
+
 
 # Define some necessary exceptions
 class InvalidPage(Exception):
@@ -99,26 +109,24 @@ class Page(object):
     def __repr__(self):
         return '<Page %s of %s>' % (self.number, self.paginator.num_pages)
 
+    def _as_list(self):
+        # The object_list is converted to a list (once) so that if it was a
+        # QuerySet it won't be a database hit per __getitem__.
+        if not isinstance(self.object_list, list):
+            self.object_list = list(self.object_list)
+        return self.object_list
+
     def __len__(self):
-        return len(self.object_list)
+        return len(self._as_list())
 
     def __getitem__(self, index):
-        # The object_list is converted to a list so that if it was a QuerySet
-        # it won't be a database hit per __getitem__.
-        return list(self.object_list)[index]
+        return self._as_list()[index]
 
     # The following four methods are only necessary for Python <2.6
     # compatibility (this class could just extend 2.6's collections.Sequence).
 
     def __iter__(self):
-        i = 0
-        try:
-            while True:
-                v = self[i]
-                yield v
-                i += 1
-        except IndexError:
-            return
+        return iter(self._as_list())
 
     def __contains__(self, value):
         for v in self:
@@ -173,6 +181,142 @@ class Page(object):
         return self.number * self.paginator.per_page
 
 
+class CursorPaginator(Paginator):
+
+    """
+    Paginates a datastore query using cursors rather than offsets so that
+    the cost of fetching a page doesn't grow with its page number.
+
+    The cursor for the start of each page is cached (in memcache too if a
+    cache_key identifying the query is given) so pages are usually fetched
+    directly.  Otherwise we skip forward from the nearest known page with
+    a single keys only query.  Counts stop at max_count, beyond which the
+    number of pages is an estimate which grows (by at most one page per
+    request) as later pages are visited.
+    """
+
+    def __init__(self, query, per_page, cache_key=None, max_count=MAX_COUNT, allow_empty_first_page=True):
+        super(CursorPaginator, self).__init__(query, per_page, allow_empty_first_page=allow_empty_first_page)
+        self.cache_key = cache_key
+        self.max_count = max_count
+        self.count_is_approximate = False
+        # cursors for the start of each page, page 1 starts at the beginning
+        self._cursors = {1: None}
+
+    def _memcache_key(self, name):
+        return 'paginator-%s:%s:%s' % (name, self.cache_key, self.per_page)
+
+    def _set_count(self, count, approximate=False):
+        self._count = count
+        self._num_pages = None
+        self.count_is_approximate = approximate
+        if self.cache_key is not None:
+            memcache.set(self._memcache_key('count'), (count, approximate), time=COUNT_CACHE_TIME)
+
+    def _get_count(self):
+        "Returns the (possibly approximate) number of objects, across all pages."
+        if self._count is None:
+            cached = None
+            if self.cache_key is not None:
+                cached = memcache.get(self._memcache_key('count'))
+            if cached is not None:
+                self._count, self.count_is_approximate = cached
+            else:
+                # count from the start of the query, stopping at max_count
+                self.object_list.with_cursor(None)
+                count = self.object_list.count(limit=self.max_count)
+                self._set_count(count, count >= self.max_count)
+        return self._count
+    count = property(_get_count)
+
+    def _get_num_pages(self):
+        "Returns the total (or estimated) number of pages."
+        if self._num_pages is None:
+            if self.count == 0 and not self.allow_empty_first_page:
+                self._num_pages = 0
+            else:
+                self._num_pages = int(ceil(max(1, self.count) / float(self.per_page)))
+        return self._num_pages
+    num_pages = property(_get_num_pages)
+
+    def validate_number(self, number):
+        "Validates the given 1-based page number."
+        # the page after an estimated last page may still exist (reading
+        # the count first so that we know whether it's an estimate) but
+        # don't allow jumping any further ahead than that
+        if self.count is not None and self.count_is_approximate:
+            try:
+                number = int(number)
+            except (TypeError, ValueError):
+                raise PageNotAnInteger('That page number is not an integer')
+            if number < 1:
+                raise EmptyPage('That page number is less than 1')
+            if number > self.num_pages + 1:
+                raise EmptyPage('That page contains no results')
+            return number
+        return super(CursorPaginator, self).validate_number(number)
+
+    def _load_cursors(self, number):
+        "Loads any cached cursors for pages up to number."
+        if self.cache_key is None:
+            return
+        keys = {}
+        for n in range(2, number + 1):
+            if n not in self._cursors:
+                keys[self._memcache_key('cursor:%s' % n)] = n
+        if not keys:
+            return
+        for key, cursor in memcache.get_multi(keys.keys()).items():
+            self._cursors[keys[key]] = cursor
+
+    def _save_cursors(self, cursors):
+        "Caches the cursors for the start of the given pages."
+        self._cursors.update(cursors)
+        if self.cache_key is not None and cursors:
+            mapping = dict((self._memcache_key('cursor:%s' % n), c) for n, c in cursors.items())
+            memcache.set_multi(mapping, time=CURSOR_CACHE_TIME)
+
+    def _last_page_reached(self, number, num_objects):
+        "Records the exact count once the end of the query has been found."
+        self._set_count((number - 1) * self.per_page + num_objects)
+
+    def page(self, number):
+        "Returns a Page object for the given 1-based page number."
+        number = self.validate_number(number)
+        query = self.object_list
+        self._load_cursors(number)
+        # start from the nearest page we know the cursor for
+        start = max(n for n in self._cursors if n <= number)
+        cursor = self._cursors[start]
+        new_cursors = {}
+        try:
+            # skip forward to the requested page with a single keys
+            # only fetch and take the cursor from the end of it
+            if start < number:
+                skip = (number - start) * self.per_page
+                keys = query.with_cursor(cursor).fetch(skip, keys_only=True)
+                if len(keys) < skip:
+                    self._set_count((start - 1) * self.per_page + len(keys))
+                    raise EmptyPage('That page contains no results')
+                cursor = query.cursor()
+                new_cursors[number] = cursor
+
+            object_list = query.with_cursor(cursor).fetch(self.per_page)
+            if len(object_list) < self.per_page:
+                if not object_list and number > 1:
+                    self._last_page_reached(number - 1, self.per_page)
+                    raise EmptyPage('That page contains no results')
+                self._last_page_reached(number, len(object_list))
+            else:
+                new_cursors[number + 1] = query.cursor()
+                # a full page means there may be at least one more
+                if self.count_is_approximate and number >= self.num_pages:
+                    self._num_pages = number + 1
+        finally:
+            self._save_cursors(new_cursors)
+        return Page(object_list, number, self)
+
+
 def paginate(objects, page_num, items_per_page=20, padding_pages=3):
 
     """
@@ -212,8 +356,38 @@ def paginate(objects, page_num, items_per_page=20, padding_pages=3):
 
     """
 
+    return _paginate(Paginator(objects, items_per_page), page_num, padding_pages)
+
+
+def cursor_paginate(query, page_num, items_per_page=20, padding_pages=3, cache_key=None):
+
+    """
+        Works exactly like paginate() (and returns the same context) but pages through
+        a datastore query using cursors rather than offsets.  See CursorPaginator.
+
+        Args:
+            query: a db.Query with the objects to be paginated
+            page_num: int num of current page to display
+            items_per_page: int number of items to display per page (default: 20)
+            cache_key: string identifying the query, used to cache cursors and counts in memcache
+
+        Returns:
+            context: dict containing values which can be added to the context and used for pagination
+    """
+
+    paginator = CursorPaginator(query, items_per_page, cache_key=cache_key)
+    context = _paginate(paginator, page_num, padding_pages)
+    context['approximate'] = paginator.count_is_approximate
+    return context
+
+
+def _paginate(paginate, page_num, padding_pages):
+
+    """
+        Build a pagination context for page_num using the given paginator
+    """
+
     context = {}
-    paginate = Paginator(objects, items_per_page)
 
     try:
         page = paginate.page(page_num)
@@ -0,0 +1,262 @@
+"""
+Parsing and validation of the simple query language used by nacelle's
+dynamic API handlers, e.g.:
+
+    ?filter=age__gte__18&filter=country__GB&order=-age
+
+Each distinct query string is parsed into a QuerySpec just once per
+instance.  Specs are checked against the datastore's restrictions and
+the composite indexes defined in index.yaml before any query is run so
+that unsupported queries can be rejected cleanly rather than failing
+with a NeedIndexError (except on the dev server, which generates the
+indexes that index.yaml is missing).
+"""
+# stdlib imports
+import logging
+import os
+
+# local imports
+from nacelle.utils.lrucache import LRUCache
+
+# filter operators, longest tokens first so that e.g. __lte__ is never
+# mistaken for __lt__
+FILTER_OPERATORS = [
+    ('__lte__', '<='),
+    ('__gte__', '>='),
+    ('__lt__', '<'),
+    ('__gt__', '>'),
+    ('__', '='),
+]
+
+# parsed specs keyed by their (sorted) raw query params
+_spec_cache = LRUCache(max_size=1000)
+
+# composite index definitions keyed by kind, loaded once per instance
+_composite_indexes = None
+
+
+class InvalidQuery(ValueError):
+
+    """
+    Raised when query params can't be parsed or describe a query the
+    datastore won't be able to run
+    """
+
+
+class QuerySpec(object):
+
+    """
+    A parsed and normalised dynamic query.
+
+    filters (list): (property, operator, value) tuples
+    orders (list): (property, direction) tuples where direction is
+                   either 'asc' or 'desc'
+    """
+
+    def __init__(self, filters, orders):
+        self.filters = filters
+        self.orders = orders
+        # kinds this spec has already been validated against
+        self.valid_kinds = set()
+        # filters are ANDed together so their order is irrelevant, whereas
+        # the order of sort orders is significant and must be preserved
+        self.canonical = '&'.join(
+            ['filter=%s%s%r' % f for f in sorted(filters)] +
+            ['order=%s%s' % ('-' if d == 'desc' else '', p) for p, d in orders]
+        )
+
+    @classmethod
+    def parse(cls, filter_params, order_params, normalise_value=None):
+
+        """
+        Build a QuerySpec from lists of raw filter and order params,
+        converting filter values with normalise_value if given
+        """
+
+        filters = []
+        for filter_param in filter_params:
+            for token, operator in FILTER_OPERATORS:
+                if token in filter_param:
+                    prop, value = filter_param.split(token, 1)
+                    break
+            else:
+                raise InvalidQuery('Invalid filter: %s' % filter_param)
+            if not prop:
+                raise InvalidQuery('Invalid filter: %s' % filter_param)
+            if normalise_value is not None:
+                value = normalise_value(value)
+            filters.append((prop, operator, value))
+
+        orders = []
+        for order_param in order_params:
+            if order_param.startswith('-'):
+                prop, direction = order_param[1:], 'desc'
+            else:
+                prop, direction = order_param, 'asc'
+            if not prop:
+                raise InvalidQuery('Invalid order: %s' % order_param)
+            orders.append((prop, direction))
+
+        return cls(filters, orders)
+
+    @property
+    def inequality_properties(self):
+        return sorted(set(p for p, o, v in self.filters if o != '='))
+
+    @property
+    def equality_properties(self):
+        return sorted(set(p for p, o, v in self.filters if o == '='))
+
+    def validate(self, kind):
+
+        """
+        Check that the datastore can run this query against entities of
+        kind, raising InvalidQuery if not
+        """
+
+        if kind in self.valid_kinds:
+            return
+
+        # the datastore only supports inequality filters on one property
+        inequality_properties = self.inequality_properties
+        if len(inequality_properties) > 1:
+            raise InvalidQuery('Inequality filters are only supported on a single property')
+        # and any sort orders must start with that property
+        if inequality_properties and self.orders and self.orders[0][0] != inequality_properties[0]:
+            raise InvalidQuery('The first sort order must be on the inequality filter property: %s' % inequality_properties[0])
+
+        index = self.required_index()
+        indexes = get_composite_indexes()
+        # unable to check without index definitions so let the datastore
+        # decide.  The dev server is also left to run every query so that
+        # it can add any missing indexes to index.yaml.
+        if index is not None and indexes is not None and not is_dev_server():
+            if not has_composite_index(indexes.get(kind, []), *index):
+                raise InvalidQuery('No composite index defined for this query')
+        self.valid_kinds.add(kind)
+
+    def required_index(self):
+
+        """
+        Return the composite index needed to run this query as a tuple of
+        (sorted equality filter properties, [(property, direction), ...]),
+        or None if the datastore's built-in indexes are sufficient
+        """
+
+        equality_properties = self.equality_properties
+        inequality_properties = self.inequality_properties
+        # sorting on a property filtered by equality has no effect
+        orders = [o for o in self.orders if o[0] not in equality_properties]
+        # results are implicitly ordered by any inequality property
+        if inequality_properties and not orders:
+            orders = [(inequality_properties[0], 'asc')]
+        # equality filters alone are handled with a merge join
+        if not orders:
+            return None
+        # filtering and/or sorting on a single property
+        if not equality_properties and len(orders) == 1:
+            return None
+        return equality_properties, orders
+
+    def apply(self, query):
+
+        """
+        Add this spec's filters and sort orders to a db.Query
+        """
+
+        for prop, operator, value in self.filters:
+            query = query.filter('%s %s' % (prop, operator), value)
+        for prop, direction in self.orders:
+            query = query.order('-' + prop if direction == 'desc' else prop)
+        return query
+
+
+def is_dev_server():
+    return os.environ.get('SERVER_SOFTWARE', '').startswith('Development')
+
+
+def has_composite_index(candidates, equality_properties, orders):
+
+    """
+    Check whether a kind's composite index definitions can serve a query
+    with the given required index (see QuerySpec.required_index).  The
+    datastore can merge join several indexes which each cover some of the
+    equality filters followed by the query's sort orders, so the query
+    can be served as long as those indexes cover every equality filter
+    between them.
+    """
+
+    # equality properties covered by usable indexes, if any were found
+    covered = None
+    for candidate in candidates:
+        prefix_length = len(candidate) - len(orders)
+        if prefix_length < 0 or candidate[prefix_length:] != orders:
+            continue
+        # equality filters may appear in the index in any order
+        prefix = set(p for p, d in candidate[:prefix_length])
+        if len(prefix) == prefix_length and prefix.issubset(equality_properties):
+            covered = prefix if covered is None else covered | prefix
+    return covered is not None and covered.issuperset(equality_properties)
+
+
+def get_query_spec(filter_params, order_params, normalise_value=None):
+
+    """
+    Return a QuerySpec for the given raw query params, reusing a previously
+    parsed spec for equivalent params where possible
+    """
+
+    # specs depend on how values are converted so key on the converter too
+    converter = getattr(normalise_value, '__func__', normalise_value)
+    key = (converter, tuple(sorted(filter_params)), tuple(order_params))
+    spec = _spec_cache.get(key)
+    if spec is None:
+        spec = QuerySpec.parse(filter_params, order_params, normalise_value)
+        _spec_cache.set(key, spec)
+    return spec
+
+
+def load_composite_indexes(path):
+
+    """
+    Parse composite index definitions from an index.yaml file, returning
+    a dict of kind to lists of [(property, direction), ...].  Ancestor
+    indexes are ignored.  Returns None if the file can't be parsed.
+    """
+
+    try:
+        from google.appengine.datastore import datastore_index
+        with open(path) as index_file:
+            definitions = datastore_index.ParseIndexDefinitions(index_file)
+    except Exception:
+        logging.warning('Unable to load index definitions from: %s' % path)
+        return None
+
+    indexes = {}
+    if definitions is None or not definitions.indexes:
+        return indexes
+    for index in definitions.indexes:
+        if index.ancestor:
+            continue
+        properties = [(p.name, p.direction or 'asc') for p in index.properties or []]
+        indexes.setdefault(index.kind, []).append(properties)
+    return indexes
+
+
+def get_composite_indexes():
+
+    """
+    Return the project's composite index definitions (see
+    load_composite_indexes), loading them on first use
+    """
+
+    global _composite_indexes
+    if _composite_indexes is None:
+        import settings
+        _composite_indexes = load_composite_indexes(os.path.join(settings.PROJECT_ROOT, 'index.yaml'))
+        # don't retry a failed load on every request
+        if _composite_indexes is None:
+            _composite_indexes = False
+    if _composite_indexes is False:
+        return None
+    return _composite_indexes
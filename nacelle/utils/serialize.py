@@ -66,45 +66,195 @@ def property_to_json(val):
     return val
 
 
-def json_to_property(val):
+def _date_to_json(val):
+    if val is None:
+        return None
+    return val.isoformat()
+
+
+def _geopt_to_json(val):
+    if val is None:
+        return None
+    return {'lat': val.lat, 'lon': val.lon}
+
+
+def _key_to_json(val):
+    if val is None:
+        return None
+    return 'key:' + str(val)
+
+
+def _text_to_json(val):
+    if val is None:
+        return None
+    return 'text:' + str(val)
+
+
+def _list_to_json(val):
+    if val:
+        return list(val)
+    return None
+
+
+# Converters for declared property types, keyed by exact property class.
+# A converter of None means the datastore value is already serialisable.
+PROPERTY_CONVERTERS = {
+    db.StringProperty: None,
+    db.IntegerProperty: None,
+    db.FloatProperty: None,
+    db.BooleanProperty: None,
+    db.DateTimeProperty: _date_to_json,
+    db.DateProperty: _date_to_json,
+    db.TimeProperty: _date_to_json,
+    db.GeoPtProperty: _geopt_to_json,
+    db.ReferenceProperty: _key_to_json,
+    db.SelfReferenceProperty: _key_to_json,
+    db.TextProperty: _text_to_json,
+}
+
+# list item types which need no conversion
+PLAIN_LIST_ITEM_TYPES = (basestring, str, unicode, int, long, float, bool)
+
+
+def get_property_converter(prop):
 
     """
-    Convert a JSON serialisable object to a datastore property
+    Return the function used to convert the datastore value of a declared
+    property to a JSON serialisable object, falling back to the generic
+    property_to_json for any property type we don't know about
     """
 
-    # Recursively process values in a list
-    if isinstance(val, list):
-        prop_list = []
-        for list_val in val:
-            list_prop = json_to_property(list_val)
-            prop_list.append(list_prop)
-        if prop_list:
-            return prop_list
-        else:
-            return None
+    prop_type = type(prop)
+    if prop_type in PROPERTY_CONVERTERS:
+        return PROPERTY_CONVERTERS[prop_type]
+    if prop_type in (db.ListProperty, db.StringListProperty):
+        if prop.item_type in PLAIN_LIST_ITEM_TYPES:
+            return _list_to_json
+    return property_to_json
 
-    # We have no real way to tell if a particular string is a
-    # date so try and parse it as an iso8601 format date
-    try:
-        date_object = iso8601.parse_date(val)
-    except:
-        pass
-    else:
-        return date_object
 
-    # Check if we're dealing with a GeoPt value
+def compile_serializer(model_class):
+
+    """
+    Build a list of (name, property, converter) tuples for all of a
+    model class's declared properties so that serialising an entity
+    doesn't have to inspect the type of every value
+    """
+
+    return [(prop.name, prop, get_property_converter(prop))
+            for prop in model_class.properties().values()]
+
+
+def _may_be_date(val):
+
+    """
+    Cheap check to rule out strings which can't possibly be parsed as
+    an iso8601 datetime before trying the (much slower) full parse
+    """
+
+    return len(val) >= 15 and val[4:5] == '-' and val[:4].isdigit()
+
+
+def _json_to_date(val):
+    if isinstance(val, basestring):
+        try:
+            return iso8601.parse_date(val)
+        except (iso8601.ParseError, TypeError, ValueError):
+            pass
+    return val
+
+
+def _json_to_geopt(val):
     if isinstance(val, dict) and (len(val) == 2) and ('lat' in val):
         if 'lon' in val:
             return db.GeoPt(val['lat'], val['lon'])
         else:
             return db.GeoPt(val['lat'])
+    return val
+
 
-    # Check if val represents a datastore key
-    if isinstance(val, (str, unicode)) and val.startswith('key:'):
-        return db.Key(encoded=val.replace('key:', ''))
+def _json_to_key(val):
+    if isinstance(val, basestring) and val.startswith('key:'):
+        return db.Key(encoded=val[4:])
+    return val
 
-    # Check if val represents a text property
-    if isinstance(val, (str, unicode)) and val.startswith('text:'):
-        return db.Text(val.replace('text:', ''))
 
+def _json_to_text(val):
+    if isinstance(val, basestring) and val.startswith('text:'):
+        return db.Text(val[5:])
     return val
+
+
+def _json_to_scalar(val):
+
+    """
+    Convert a single (non-list) JSON value to a datastore property
+    value when we don't know what type of property it is destined for
+    """
+
+    if isinstance(val, basestring):
+        # Check if val represents a datastore key
+        if val.startswith('key:'):
+            return db.Key(encoded=val[4:])
+        # Check if val represents a text property
+        if val.startswith('text:'):
+            return db.Text(val[5:])
+        # We have no real way to tell if a particular string is a
+        # date so try and parse it as an iso8601 format date
+        if _may_be_date(val):
+            return _json_to_date(val)
+        return val
+
+    # Check if we're dealing with a GeoPt value
+    if isinstance(val, dict):
+        return _json_to_geopt(val)
+
+    # ints, floats, bools and None need no conversion
+    return val
+
+
+# Converters for values destined for declared property types, keyed
+# by exact property class. A converter of None means no conversion.
+JSON_CONVERTERS = {
+    db.StringProperty: None,
+    db.IntegerProperty: None,
+    db.FloatProperty: None,
+    db.BooleanProperty: None,
+    db.DateTimeProperty: _json_to_date,
+    db.DateProperty: _json_to_date,
+    db.TimeProperty: _json_to_date,
+    db.GeoPtProperty: _json_to_geopt,
+    db.ReferenceProperty: _json_to_key,
+    db.SelfReferenceProperty: _json_to_key,
+    db.TextProperty: _json_to_text,
+}
+
+
+def json_to_property(val, prop=None):
+
+    """
+    Convert a JSON serialisable object to a datastore property. If the
+    declared property the value is destined for is passed then the
+    conversion is picked from its type rather than guessed from the value.
+    """
+
+    if prop is not None:
+        prop_type = type(prop)
+        if prop_type in JSON_CONVERTERS:
+            converter = JSON_CONVERTERS[prop_type]
+            if converter is None:
+                return val
+            return converter(val)
+        if prop_type in (db.ListProperty, db.StringListProperty):
+            if prop.item_type in PLAIN_LIST_ITEM_TYPES:
+                return val
+
+    # Process each value in a list (lists can't be nested)
+    if isinstance(val, list):
+        prop_list = [_json_to_scalar(list_val) for list_val in val]
+        if prop_list:
+            return prop_list
+        else:
+            return None
+
+    return _json_to_scalar(val)
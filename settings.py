@@ -12,16 +12,32 @@ PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
 
 # When debug is enabled, error pages will contain full tracebacks
 DEBUG = True
+# Limit the size of local variables shown on debug error pages
+DEBUG_TRUNCATE_LOCALS = True
 
 # Sentry settings
 ENABLE_SENTRY = True
 SENTRY_DSN = ''
+# Send events in batches from a deferred task rather than during the request
+SENTRY_ASYNC = True
+# Identical events are only reported once within this many seconds
+SENTRY_DEDUPE_WINDOW = 60
+# Maximum number of events reported per minute (None for no limit)
+SENTRY_RATE_LIMIT = 60
+# Number of seconds between flushes of queued events
+SENTRY_FLUSH_INTERVAL = 10
 
 # Additional template extensions and filters to
 # be applied to any Jinja instances
 TEMPLATE_EXTENSIONS = []
 TEMPLATE_FILTERS = []
 
+# Path (relative to PROJECT_ROOT) of a bundle of precompiled templates built
+# with `python nacelle/compile_templates.py`.  When set, templates are loaded
+# only from this bundle (except in DEBUG mode unless TEMPLATE_FORCE_COMPILED)
+TEMPLATE_COMPILED_PATH = None
+TEMPLATE_FORCE_COMPILED = False
+
 # Dictionary that is passed to our WSGI app to provide extra webapp2 config
 # set our super secret session key
 WSGI_CONFIG = {}